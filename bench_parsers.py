@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Compara tiempo de parseo y memoria pico de cada backend HTML sobre la misma página"""
+
+import argparse
+import time
+import tracemalloc
+
+from bot_loader import load_bot
+
+bot = load_bot()
+
+
+def measure(parse, repeat):
+    """Mejor tiempo de `repeat` ejecuciones y memoria pico de una de ellas"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    parse()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('html', nargs='?', help="Archivo HTML de la portada (por defecto se descarga)")
+    parser.add_argument('--repeat', type=int, default=5, help="Repeticiones por medida")
+    args = parser.parse_args()
+
+    if args.html:
+        with open(args.html, 'rb') as f:
+            page = f.read()
+    else:
+        print(f"📡 Descargando {bot.PROCYCLING_URL}...")
+        page = bot.HttpClient().get(bot.PROCYCLING_URL).content
+
+    section = bot.extract_results_section(page.decode('utf-8', errors='replace'))
+    print(f"Página: {len(page)} bytes, sección 'Results today': {len(section) if section else 0} bytes\n")
+
+    print(f"{'backend':<14}{'modo':<12}{'tiempo (ms)':>14}{'pico (KiB)':>14}")
+    for backend in bot.available_parser_backends():
+        cases = [('completo', lambda: bot.make_soup(page, parser=backend))]
+        if section:
+            cases.append(('sección', lambda: bot.make_soup(section, parser=backend)))
+        cases.append(('tablas/ul', lambda: bot.make_soup(page, parse_only=bot.make_strainer(*bot.RACE_PAGE_TAGS), parser=backend)))
+
+        for mode, parse in cases:
+            elapsed, peak = measure(parse, args.repeat)
+            print(f"{backend:<14}{mode:<12}{elapsed * 1000:>14.2f}{peak / 1024:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
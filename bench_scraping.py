@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""Benchmark offline del scraping: portada y página de carrera grabadas, sin red"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bot_loader import load_bot
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BASE_DIR, 'fixtures')
+HOMEPAGE_FIXTURE = os.path.join(FIXTURES_DIR, 'homepage.html')
+RACE_FIXTURE = os.path.join(FIXTURES_DIR, 'race.html')
+BASELINE_FILE = os.path.join(BASE_DIR, 'bench_baseline.json')
+
+bot = load_bot()
+
+# Por debajo de esta diferencia (ms) no se considera regresión: es ruido del reloj
+MIN_REGRESSION_MS = 2.0
+
+# Iteraciones del bucle de calibración: unos milisegundos de Python puro
+CALIBRATION_ITERATIONS = 20000
+CALIBRATION_PATTERN = re.compile(r'\((\d\.\w+)\)')
+
+
+def calibration_loop():
+    """Trabajo fijo (cadenas, regex y dict) con el que se mide la velocidad de la máquina"""
+    counts = {}
+    for n in range(CALIBRATION_ITERATIONS):
+        match = CALIBRATION_PATTERN.search(f"Race {n} (1.{n % 7}UWT)")
+        key = match.group(1).lower()
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+class StubResponse:
+    """Respuesta HTTP mínima servida desde memoria"""
+
+    def __init__(self, content):
+        self.status_code = 200
+        self.ok = True
+        self.content = content
+        self.text = content.decode('utf-8')
+        self.encoding = 'utf-8'
+        self.headers = {}
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubHttp:
+    """Sustituye a HttpClient: la portada y cualquier otra URL salen de fixtures"""
+
+    def __init__(self, homepage, race_page):
+        self.homepage = StubResponse(homepage)
+        self.race_page = StubResponse(race_page)
+        self.stats = {}
+        self.status_codes = {}
+        self.cache = None
+
+    def get(self, url, **kwargs):
+        return self.homepage if url == bot.PROCYCLING_URL else self.race_page
+
+    def record_bytes(self, count):
+        pass
+
+    def log_stats(self):
+        pass
+
+
+def synthetic_homepage(template, items):
+    """Repite los LI de 'Results today' del fixture hasta tener `items` elementos"""
+    section = bot.extract_results_section(template)
+    ul_start = section.index('<ul')
+    body_start = section.index('>', ul_start) + 1
+    body_end = section.rindex('</ul>')
+    lis = re.findall(r'<li>.*?</li>', section[body_start:body_end], re.S)
+
+    generated = []
+    for n in range(items):
+        li = lis[n % len(lis)]
+        # Nombres distintos para que cada carrera tenga su propio hash
+        generated.append(re.sub(r'(\(\w[\w.]*\))', rf'#{n} \1', li, count=1))
+    new_section = section[:body_start] + '\n'.join(generated) + section[body_end:]
+    return template.replace(section, new_section)
+
+
+def measure(func, repeat):
+    """Mejor tiempo (ms) de `repeat` ejecuciones y memoria pico (KiB) de una más
+
+    Cada ejecución va precedida del bucle de calibración: su mejor tiempo
+    (calibration_ms) refleja la velocidad de la máquina en ese mismo momento
+    y permite comparar con una línea base grabada en otra máquina.
+    """
+    best = float('inf')
+    calibration = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        calibration_loop()
+        calibration = min(calibration, time.perf_counter() - start)
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'time_ms': round(best * 1000, 3), 'calibration_ms': round(calibration * 1000, 3),
+            'peak_kib': round(peak / 1024, 1)}
+
+
+def make_bot(homepage, race_page):
+    """Bot con estado en memoria, sin Telegram y con HTTP servido desde fixtures"""
+    state_dir = tempfile.mkdtemp(prefix='procycling-bench-')
+    bot.CACHE_FILE = os.path.join(state_dir, 'sent.json')
+    bot.SENT_RESULTS_DB = ':memory:'
+    bot.RESULTS_DB = ':memory:'
+    bot.FETCH_STATE_FILE = os.path.join(state_dir, 'fetch_state.json')
+    bot.CIRCUIT_STATE_FILE = os.path.join(state_dir, 'circuits.json')
+    bot.ENRICH_RACES = False
+    bot.HTTP_CACHE_ENABLED = False
+    instance = bot.ProCyclingAlertBot()
+    instance.http = StubHttp(homepage, race_page)
+    return instance
+
+
+def run_stages(label, homepage, race_page, repeat):
+    """Mide cada etapa del camino caliente sobre una portada"""
+    instance = make_bot(homepage.encode('utf-8'), race_page.encode('utf-8'))
+    results = {}
+
+    results[f'scrape_today_winners@{label}'] = measure(instance.scrape_today_winners, repeat)
+
+    # Entradas de las etapas internas, preparadas fuera de la medida
+    soup = bot.make_soup(bot.extract_results_section(homepage))
+    items = soup.find('h3', string='Results today').find_next_sibling('ul').find_all('li')
+    extractor = instance.extractor
+    token_lists = [extractor.tokenize(item) for item in items]
+    race_names = [item.race_name for item in map(extractor.extract, items) if item]
+    _, races = instance.scrape_today_winners()
+
+    results[f'extract_items@{label}'] = measure(lambda: [extractor.extract(item) for item in items], repeat)
+    results[f'parse_podium@{label}'] = measure(
+        lambda: [extractor.parse_podium(tokens) for tokens in token_lists], repeat)
+    results[f'is_allowed_category@{label}'] = measure(
+        lambda: [bot.is_allowed_category(name) for name in race_names], repeat)
+    results[f'format_message@{label}'] = measure(lambda: instance.format_message(races), repeat)
+    return results
+
+
+def time_regression(name, current, reference, tolerance, field='time_ms'):
+    """Texto de la regresión de `field` respecto a la referencia, o None
+
+    El tiempo de referencia se escala con el cociente entre las
+    calibraciones actual y de la referencia, así que una máquina más lenta
+    (o más cargada) no cuenta como regresión. También lo usa bench_startup.py.
+    """
+    reference_ms = reference[field]
+    if reference.get('calibration_ms'):
+        reference_ms *= current['calibration_ms'] / reference['calibration_ms']
+    limit = reference_ms * (1 + tolerance)
+    if current[field] > limit and current[field] - reference_ms > MIN_REGRESSION_MS:
+        return f"{name}: {current[field]:.2f} ms > {limit:.2f} ms"
+    return None
+
+
+def compare(results, baseline, tolerance):
+    """Lista de regresiones respecto a la línea base"""
+    regressions = []
+    for key, current in results.items():
+        reference = baseline.get(key)
+        if not reference:
+            continue
+        regression = time_regression(key, current, reference, tolerance)
+        if regression:
+            regressions.append(regression)
+        limit = reference['peak_kib'] * (1 + tolerance)
+        if current['peak_kib'] > limit:
+            regressions.append(f"{key}: {current['peak_kib']:.1f} KiB > {limit:.1f} KiB")
+    return regressions
+
+
+def record_fixtures():
+    """Descarga la portada real y la página de su primera carrera como nuevos fixtures"""
+    http = bot.HttpClient()
+    homepage = http.get(bot.PROCYCLING_URL).text
+    section = bot.extract_results_section(homepage)
+    if not section:
+        sys.exit("❌ La portada no tiene sección 'Results today', no se graba nada")
+    race_href = re.search(r'<a href="([^"]+)"', section).group(1)
+    race_page = http.get(bot.urljoin(bot.PROCYCLING_URL + '/', race_href)).text
+
+    with open(HOMEPAGE_FIXTURE, 'w', encoding='utf-8') as f:
+        f.write(homepage)
+    with open(RACE_FIXTURE, 'w', encoding='utf-8') as f:
+        f.write(race_page)
+    print(f"✅ Fixtures grabados en {FIXTURES_DIR}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='100,1000',
+                        help="Tamaños de la lista sintética de 'Results today' (separados por comas)")
+    parser.add_argument('--repeat', type=int, default=5, help="Repeticiones por medida")
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help="Margen sobre la línea base antes de dar una regresión (1.0 = +100%%)")
+    parser.add_argument('--update-baseline', action='store_true', help="Guarda los resultados como línea base")
+    parser.add_argument('--record', action='store_true', help="Graba los fixtures desde la web real y termina")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures()
+        return
+
+    # Los logs por carrera falsearían las medidas
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with open(HOMEPAGE_FIXTURE, encoding='utf-8') as f:
+        homepage = f.read()
+    with open(RACE_FIXTURE, encoding='utf-8') as f:
+        race_page = f.read()
+
+    results = run_stages('fixture', homepage, race_page, args.repeat)
+    for size in (int(s) for s in args.sizes.split(',') if s):
+        results.update(run_stages(str(size), synthetic_homepage(homepage, size), race_page, args.repeat))
+
+    instance = make_bot(homepage.encode('utf-8'), race_page.encode('utf-8'))
+    results['scrape_race_podium@fixture'] = measure(
+        lambda: instance.scrape_race_podium(bot.PROCYCLING_URL + '/race/fixture'), args.repeat)
+
+    print(f"{'etapa':<40}{'tiempo (ms)':>14}{'calibración (ms)':>18}{'pico (KiB)':>14}")
+    for key, value in results.items():
+        print(f"{key:<40}{value['time_ms']:>14.3f}{value['calibration_ms']:>18.3f}{value['peak_kib']:>14.1f}")
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\n✅ Línea base guardada en {BASELINE_FILE}")
+        return
+
+    if not os.path.exists(BASELINE_FILE):
+        print("\nℹ️ Sin línea base: ejecuta con --update-baseline para crearla")
+        return
+
+    with open(BASELINE_FILE) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n❌ Regresiones respecto a la línea base:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print("\n✅ Sin regresiones respecto a la línea base")
+
+
+if __name__ == '__main__':
+    main()
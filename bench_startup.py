@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Coste de arranque del bot (-X importtime) frente al presupuesto de startup_budget.json"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_scraping import calibration_loop, time_regression
+from bot_loader import load_bot
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HOMEPAGE_FIXTURE = os.path.join(BASE_DIR, 'fixtures', 'homepage.html')
+BUDGET_FILE = os.path.join(BASE_DIR, 'startup_budget.json')
+
+bot = load_bot()
+
+MARKER = '--- bench_startup ---'
+
+# Proceso hijo: intérprete limpio que carga el bot y, si toca, hace un sondeo
+CHILD = f"""
+import sys, time
+scenario, base_dir, url, state_dir = sys.argv[1:5]
+sys.path.insert(0, base_dir)
+import bot_loader
+start = time.perf_counter()
+before = set(sys.modules)
+sys.stderr.write({MARKER!r} + '\\n')
+sys.stderr.flush()
+bot = bot_loader.load_bot()
+if scenario != 'import':
+    import os
+    bot.PROCYCLING_URL = url
+    bot.CACHE_FILE = os.path.join(state_dir, 'sent.json')
+    bot.SENT_RESULTS_DB = os.path.join(state_dir, 'sent.sqlite')
+    bot.RESULTS_DB = os.path.join(state_dir, 'results.sqlite')
+    bot.FETCH_STATE_FILE = os.path.join(state_dir, 'fetch_state.json')
+    bot.CIRCUIT_STATE_FILE = os.path.join(state_dir, 'circuits.json')
+    bot.HTTP_CACHE_ENABLED = False
+    instance = bot.ProCyclingAlertBot()
+    instance.run()
+    instance.close()
+total_ms = (time.perf_counter() - start) * 1000
+modules = sorted(set(sys.modules) - before)
+import json
+print(json.dumps({{'total_ms': total_ms, 'modules': modules}}))
+"""
+
+# Qué hace cada escenario y qué módulos no deben llegar a importarse en él
+SCENARIOS = {
+    'import': "Cargar el script sin hacer nada",
+    'poll_304': "Sondeo con la portada sin cambios (304 Not Modified)",
+    'poll_unchanged': "Sondeo con 'Results today' igual que en el anterior",
+}
+
+
+class FakePCS(http.server.BaseHTTPRequestHandler):
+    """Portada de PCS desde el fixture, o 304 si el escenario lo pide"""
+
+    page = b''
+    not_modified = False
+
+    def do_GET(self):
+        if self.not_modified:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.page)))
+        self.send_header('ETag', '"bench"')
+        self.end_headers()
+        self.wfile.write(self.page)
+
+    def log_message(self, *args):
+        pass
+
+
+def parse_importtime(stderr):
+    """Tiempo acumulado (ms) de los imports de primer nivel posteriores al marcador y los más pesados"""
+    lines = stderr.split(MARKER, 1)[-1].splitlines()
+    top_level = []
+    for line in lines:
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Los imports anidados llevan sangría extra en el nombre
+        if not name.startswith('  '):
+            top_level.append((int(cumulative) / 1000, name.strip()))
+    return sum(ms for ms, _ in top_level), sorted(top_level, reverse=True)[:5]
+
+
+def run_child(scenario, url, state_dir):
+    """Lanza el intérprete hijo y devuelve (import ms, total ms, módulos cargados, más pesados)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD, scenario, BASE_DIR, url, state_dir],
+        capture_output=True, text=True, check=True,
+        env={**os.environ, 'PROCYCLING_OFFLINE': '0', 'METRICS_PROM_FILE': '', 'METRICS_JSON_FILE': ''}
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    import_ms, heaviest = parse_importtime(result.stderr)
+    return import_ms, report['total_ms'], set(report['modules']), heaviest
+
+
+def measure(scenario, repeat, url):
+    """Mejor resultado de `repeat` arranques en frío del escenario y mejor calibración (ms)
+
+    Antes de cada arranque se mide calibration_loop(), como en
+    bench_scraping.py, para comparar con un presupuesto de otra máquina.
+    """
+    best = None
+    calibration = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        calibration_loop()
+        calibration = min(calibration, time.perf_counter() - start)
+        with tempfile.TemporaryDirectory(prefix='procycling-startup-') as state_dir:
+            # Estado de un sondeo anterior que ya procesó esta misma portada
+            with open(HOMEPAGE_FIXTURE, encoding='utf-8') as f:
+                section = bot.extract_results_section(f.read())
+            with open(os.path.join(state_dir, 'fetch_state.json'), 'w') as f:
+                json.dump({'etag': '"bench"', 'last_modified': '',
+                           'section_hash': hashlib.md5(section.encode()).hexdigest()}, f)
+            FakePCS.not_modified = scenario == 'poll_304'
+            sample = run_child(scenario, url, state_dir)
+        if best is None or sample[0] < best[0]:
+            best = sample
+    return best, calibration * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5, help="Arranques por escenario (se queda el mejor)")
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help="Margen sobre el presupuesto antes de dar una regresión (1.0 = +100%%), "
+                             "como en bench_scraping.py")
+    parser.add_argument('--update-budget', action='store_true', help="Guarda lo medido como presupuesto")
+    args = parser.parse_args()
+
+    with open(HOMEPAGE_FIXTURE, 'rb') as f:
+        FakePCS.page = f.read()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakePCS)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    budget = {}
+    if os.path.exists(BUDGET_FILE):
+        with open(BUDGET_FILE) as f:
+            budget = json.load(f)
+
+    failures = []
+    results = {}
+    print(f"{'escenario':<18}{'imports (ms)':>14}{'total (ms)':>14}{'calibración (ms)':>18}{'presupuesto':>14}")
+    for scenario, description in SCENARIOS.items():
+        (import_ms, total_ms, modules, heaviest), calibration_ms = measure(scenario, args.repeat, url)
+        current = {'import_ms': round(import_ms, 1), 'total_ms': round(total_ms, 1),
+                   'calibration_ms': round(calibration_ms, 3)}
+        results[scenario] = current
+        limits = budget.get(scenario, {})
+        print(f"{scenario:<18}{import_ms:>14.1f}{total_ms:>14.1f}{calibration_ms:>18.3f}"
+              f"{limits.get('import_ms', float('nan')):>14.1f}  {description}")
+        print("    más pesados: " + ", ".join(f"{name} {ms:.1f}" for ms, name in heaviest))
+
+        for field in ('import_ms', 'total_ms'):
+            if field in limits:
+                regression = time_regression(f"{scenario} ({field})", current, limits, args.tolerance, field)
+                if regression:
+                    failures.append(regression)
+        for module in limits.get('forbidden', []):
+            if module in modules:
+                failures.append(f"{scenario}: se ha importado {module}")
+    server.shutdown()
+
+    if args.update_budget:
+        for scenario, measured in results.items():
+            budget.setdefault(scenario, {}).update(measured)
+        with open(BUDGET_FILE, 'w') as f:
+            json.dump(budget, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\n✅ Presupuesto guardado en {BUDGET_FILE}")
+        return
+
+    if not budget:
+        print("\nℹ️ Sin presupuesto: ejecuta con --update-budget para crearlo")
+        return
+    if failures:
+        print("\n❌ Arranque por encima del presupuesto:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\n✅ Arranque dentro del presupuesto")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""Carga del bot para los scripts de benchmark y de pruebas de carga"""
+
+import importlib.util
+import os
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'procycling-alert-bot.py')
+
+
+def load_bot():
+    """Ejecuta procycling-alert-bot.py y lo devuelve como módulo
+
+    El bot vive en un script con guiones, así que se carga por ruta. La
+    configuración se lee del entorno al cargarlo: cada llamada devuelve un
+    módulo nuevo con el entorno de ese momento.
+    """
+    spec = importlib.util.spec_from_file_location('procycling_alert_bot', BOT_PATH)
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    return bot
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""Pruebas de carga del bot contra un PCS y una Bot API de Telegram falsos, en local"""
+
+import argparse
+import http.server
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import bot_loader
+
+TELEGRAM_TOKEN = 'load-test-token'
+RACE_NAME_PATTERN = re.compile(r'Load Test Race (\d+)')
+
+# Clases UCI que se reparten entre las carreras generadas (unas pasan el filtro y otras no)
+RACE_CLASSES = ['2.UWT', 'GT.A', '1.1', '1.Pro', '2.2']
+RIDERS = ['Pogačar Tadej', 'Vingegaard Jonas', 'Evenepoel Remco', 'van der Poel Mathieu',
+          'Pedersen Mads', 'Kämna Lennard', 'Wellens Tim', 'Vauquelin Kévin', 'Gall Felix',
+          'Powless Neilson', 'van Aert Wout', 'Lipowitz Florian', 'Seixas Paul']
+TEAMS = ['UAD', 'TVL', 'SOQ', 'LTK', 'RBH', 'EFE', 'DAT', 'ARK']
+LAYOUTS = ['standard', 'no_team', 'winner_only']
+# Además de LAYOUTS, 'no_podium': solo el enlace de la carrera y 'view results'
+
+# Valores por defecto de cada escenario; cada uno cambia solo lo que le interesa
+DEFAULT_SCENARIO = {
+    'races': 40,             # Carreras en 'Results today' al final de la prueba
+    'first': None,           # Visibles en la primera ronda (None = todas)
+    'step': 0,               # Carreras nuevas que aparecen en cada ronda siguiente
+    'rounds': 2,             # Ejecuciones del bot (como sondeos sucesivos del daemon)
+    'layout': 'mixed',       # standard, no_team, winner_only o mixed (rota entre ellos)
+    'etag': True,            # La portada responde 304 si no ha cambiado
+    'shuffle': False,        # Reordena la lista en cada ronda: la sección cambia y el bot debe deduplicar
+    'padding_kb': 200,       # HTML de la portada después de 'Results today'
+    'homepage_latency': 0.05,
+    'race_latency': 0.02,
+    'error_rate': 0.0,       # Fracción de peticiones a PCS que responden 503
+    'throttle_rate': 0.0,    # Fracción de peticiones a PCS que responden 429
+    'retry_after': 1,        # Segundos de Retry-After en los 429 de PCS
+    'tg_latency': 0.01,
+    'tg_chat_rate': 1.0,     # Límites de Telegram: mensajes/s por chat...
+    'tg_chat_burst': 3,
+    'tg_global_rate': 30.0,  # ... en total...
+    'tg_global_burst': 30,
+    'tg_group_per_minute': 20,  # ... y por minuto a cada grupo o canal (chat_id negativo)
+    'tg_failing_chat': None, # Chat (índice) al que la Bot API responde 400...
+    'tg_failing_rounds': 0,  # ... durante estas primeras rondas
+    'pcs_down_rounds': (),   # Rondas en las que la portada responde siempre 503
+    'late_podium': False,    # En la primera ronda la portada solo trae al ganador; el podio llega después
+    'late_winner': False,    # En la primera ronda la portada no trae podio, solo 'view results'
+    'upper_surnames': False, # La página de carrera escribe el apellido en mayúsculas, como la real
+    'pipeline': False,       # run_pipeline() en vez de run()
+}
+
+SCENARIOS = {
+    'baseline': {
+        'description': "Portada estable: la segunda ronda recibe un 304",
+    },
+    'slow_pages': {
+        'description': "Páginas de carrera lentas y podios incompletos en la portada",
+        'races': 30, 'rounds': 1, 'layout': 'winner_only', 'race_latency': 0.5,
+    },
+    'flaky_pcs': {
+        'description': "PCS con 503 y 429 intermitentes y la lista reordenada en cada ronda",
+        'races': 80, 'rounds': 3, 'etag': False, 'shuffle': True, 'error_rate': 0.15, 'throttle_rate': 0.1,
+    },
+    'telegram_throttled': {
+        'description': "Bot API con un límite global más bajo que el del bot (429 con retry_after)",
+        'races': 30, 'rounds': 1, 'tg_global_rate': 1.0, 'tg_global_burst': 1,
+    },
+    'failing_chat': {
+        'description': "Un chat falla en la primera ronda: la segunda le entrega solo lo que le falta",
+        'races': 20, 'rounds': 3, 'tg_failing_chat': 1, 'tg_failing_rounds': 1,
+    },
+    'failing_chat_pipeline': {
+        'description': "Lo mismo en modo pipeline",
+        'races': 8, 'rounds': 3, 'tg_failing_chat': 1, 'tg_failing_rounds': 1, 'pipeline': True,
+    },
+    'pcs_outage': {
+        'description': "Un chat falla en la primera ronda y PCS cae en la segunda: el chat la recibe al volver",
+        'races': 12, 'rounds': 4, 'tg_failing_chat': 1, 'tg_failing_rounds': 1, 'pcs_down_rounds': (1,),
+    },
+    'late_podium': {
+        'description': "El podio llega a la portada después de completarse con la página de carrera: no se edita",
+        'races': 12, 'rounds': 3, 'layout': 'standard', 'etag': False, 'late_podium': True, 'upper_surnames': True,
+    },
+    'late_winner': {
+        'description': "La primera línea de la portada no trae podio; cuando aparece, coincide con el enviado: no se reenvía",
+        'races': 12, 'rounds': 3, 'layout': 'standard', 'etag': False, 'late_winner': True, 'upper_surnames': True,
+    },
+    'growing_pipeline': {
+        'description': "Modo pipeline con carreras que van apareciendo ronda a ronda",
+        'races': 12, 'first': 4, 'step': 4, 'rounds': 3, 'pipeline': True,
+    },
+    'big_day': {
+        'description': "Portada con muchas carreras, reordenada y sin ETag",
+        'races': 300, 'rounds': 2, 'etag': False, 'shuffle': True,
+    },
+    'big_day_pipeline': {
+        'description': "Muchas carreras en modo pipeline: se agrupan en mensajes, sin pasar del límite de los grupos",
+        'races': 300, 'rounds': 1, 'pipeline': True,
+    },
+}
+
+
+def race_class(index):
+    return RACE_CLASSES[index % len(RACE_CLASSES)]
+
+
+def race_layout(layout, index):
+    return LAYOUTS[index % len(LAYOUTS)] if layout == 'mixed' else layout
+
+
+def race_podium(index):
+    """Tres ciclistas distintos y sus tiempos, fijos para cada carrera"""
+    riders = [RIDERS[(index + offset * 5) % len(RIDERS)] for offset in range(3)]
+    times = [f"{3 + index % 3}:{index % 60:02d}:{(index * 7) % 60:02d}", ',,', f"0:{index % 50 + 5:02d}"]
+    return list(zip(riders, times))
+
+
+def generate_homepage(visible, layout, padding_kb, order_seed=None):
+    """Portada con `visible` carreras en 'Results today' y relleno detrás, como la real"""
+    order = list(range(visible))
+    if order_seed is not None:
+        random.Random(order_seed).shuffle(order)
+    items = []
+    for index in order:
+        href = f"race/load-test-{index:04d}/2025"
+        variant = race_layout(layout, index)
+        podium = race_podium(index)[:{'winner_only': 1, 'no_podium': 0}.get(variant, 3)]
+        parts = [f'<li><a href="{href}"><span class="flag fr"></span></a>'
+                 f'<a href="{href}">Load Test Race {index:04d} ({race_class(index)})</a>']
+        if not podium:
+            parts.append(f'<a href="{href}">view results</a>')
+        for pos, (rider, time_text) in enumerate(podium, 1):
+            parts.append(f'<div class="pos">{pos}</div><a href="rider/{rider.lower().replace(" ", "-")}">{rider}</a>')
+            if variant != 'no_team':
+                parts.append(f'<span class="team">{TEAMS[(index + pos) % len(TEAMS)]}</span>')
+            parts.append(f'<span class="time">{time_text}</span>')
+        parts.append('</li>')
+        items.append(''.join(parts))
+
+    filler = '<li><a href="race/upcoming">Upcoming race</a></li>\n' * (padding_kb * 1024 // 50)
+    return (
+        '<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="utf-8"><title>ProCyclingStats</title></head>\n'
+        '<body>\n<h3>Results today</h3>\n<ul class="list horizontal fs14">\n'
+        + '\n'.join(items) +
+        '\n</ul>\n<h3>Upcoming races</h3>\n<ul>\n' + filler + '</ul>\n</body>\n</html>\n'
+    ).encode('utf-8')
+
+
+def upper_surname(rider):
+    """'van der Poel Mathieu' -> 'VAN DER POEL Mathieu'"""
+    *surname, first_name = rider.split()
+    return ' '.join([word.upper() for word in surname] + [first_name])
+
+
+def generate_race_page(index, upper_surnames=False):
+    """Página de resultados de una carrera: tabla con el top 5 y ubicación junto a la bandera"""
+    rows = []
+    podium = race_podium(index) + [(RIDERS[(index + 3) % len(RIDERS)], '0:31'), (RIDERS[(index + 4) % len(RIDERS)], '0:45')]
+    for pos, (rider, time_text) in enumerate(podium, 1):
+        if upper_surnames:
+            rider = upper_surname(rider)
+        rows.append(f'<tr><td>{pos}</td><td>{pos * 10}</td><td><span class="flag fr"></span> '
+                    f'<a href="rider/{rider.lower().replace(" ", "-")}">{rider}</a></td>'
+                    f'<td><a href="team/load-test">Load Test Team</a></td><td class="time">{time_text}</td></tr>')
+    return (
+        '<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="utf-8"></head>\n<body>\n'
+        f'<div class="page-title"><div class="main"><span class="flag fr"></span> France<h1>Load Test Race {index:04d}</h1></div></div>\n'
+        '<table class="results basic"><tbody>\n' + '\n'.join(rows) + '\n</tbody></table>\n'
+        '<ul class="infolist"><li><div>Distance:</div><div>180 km</div></li></ul>\n</body>\n</html>\n'
+    ).encode('utf-8')
+
+
+class RateLimiter:
+    """Token bucket sin espera: indica si una petición cabe o cuánto falta para que quepa"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """0 si la petición entra; si no, segundos hasta que haya hueco"""
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+
+class FakeServer(http.server.ThreadingHTTPServer):
+    """Servidor local con la configuración del escenario y contadores compartidos"""
+
+    daemon_threads = True
+
+    def __init__(self, handler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.lock = threading.Lock()
+        self.scenario = dict(DEFAULT_SCENARIO)
+        self.reset()
+
+    def reset(self, scenario=None):
+        with self.lock:
+            if scenario is not None:
+                self.scenario = scenario
+            self.counts = Counter()
+            self.random = random.Random(0)
+            self.visible = 0
+            self.round = 0
+            self.failing_chat = None
+            self.homepage = b''
+            self.messages = []   # Telegram: (instante, chat, message_id, texto)
+            self.edits = []
+            self.chat_limiter = RateLimiter(self.scenario['tg_chat_rate'], self.scenario['tg_chat_burst'])
+            self.global_limiter = RateLimiter(self.scenario['tg_global_rate'], self.scenario['tg_global_burst'])
+            self.group_limiter = RateLimiter(self.scenario['tg_group_per_minute'] / 60,
+                                             self.scenario['tg_group_per_minute'])
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def handle_error(self, request, client_address):
+        # El bot cierra la portada a mitad de descarga: no es un error del servidor
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 para que el cliente reutilice conexiones como con los servidores reales
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status, body=b'', headers=None, content_type='text/html; charset=utf-8'):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            # El bot corta la portada en cuanto termina 'Results today'
+            for start in range(0, len(body), 16 * 1024):
+                self.wfile.write(body[start:start + 16 * 1024])
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class FakePCSHandler(FakeHandler):
+    """Portada generada, páginas de carrera, latencia y errores inyectados"""
+
+    def do_GET(self):
+        server = self.server
+        scenario = server.scenario
+        path = self.path.split('?')[0]
+        is_homepage = path in ('', '/')
+        kind = 'homepage' if is_homepage else 'race_page'
+        server.count(kind)
+        time.sleep(scenario['homepage_latency' if is_homepage else 'race_latency'])
+
+        if is_homepage and server.round in scenario['pcs_down_rounds']:
+            server.count('injected_5xx')
+            return self.reply(503, b'Service Unavailable')
+        with server.lock:
+            roll = server.random.random()
+        if roll < scenario['throttle_rate']:
+            server.count('injected_429')
+            return self.reply(429, b'Too Many Requests', {'Retry-After': str(scenario['retry_after'])})
+        if roll < scenario['throttle_rate'] + scenario['error_rate']:
+            server.count('injected_5xx')
+            return self.reply(503, b'Service Unavailable')
+
+        if is_homepage:
+            etag = f'"{server.visible}-{scenario["layout"]}"'
+            if scenario['etag'] and self.headers.get('If-None-Match') == etag:
+                server.count('homepage_304')
+                return self.reply(304, headers={'ETag': etag})
+            server.count('homepage_200')
+            return self.reply(200, server.homepage, {'ETag': etag} if scenario['etag'] else None)
+
+        match = re.match(r'^/race/load-test-(\d+)/', path)
+        if not match:
+            server.count('not_found')
+            return self.reply(404, b'Not Found')
+        return self.reply(200, generate_race_page(int(match.group(1)), scenario['upper_surnames']))
+
+
+class FakeTelegramHandler(FakeHandler):
+    """sendMessage y editMessageText con los límites de ritmo de Telegram"""
+
+    def do_POST(self):
+        server = self.server
+        scenario = server.scenario
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(scenario['tg_latency'])
+
+        match = re.match(r'^/bot([^/]+)/(\w+)$', self.path)
+        if not match or match.group(1) != TELEGRAM_TOKEN:
+            server.count('unauthorized')
+            return self.error(401, 'Unauthorized')
+        method = match.group(2)
+        if method not in ('sendMessage', 'editMessageText'):
+            return self.error(404, 'Not Found')
+
+        payload = json.loads(body or b'{}')
+        chat_id = str(payload.get('chat_id'))
+        text = payload.get('text', '')
+        if len(text) > 4096:
+            server.count('too_long')
+            return self.error(400, 'Bad Request: message is too long')
+        if chat_id == server.failing_chat and server.round < scenario['tg_failing_rounds']:
+            server.count('failed_chat')
+            return self.error(400, 'Bad Request: chat not found')
+
+        wait = (server.chat_limiter.take(chat_id)
+                or (chat_id.startswith('-') and server.group_limiter.take(chat_id))
+                or server.global_limiter.take('global'))
+        if wait:
+            server.count('throttled')
+            retry_after = math.ceil(wait)
+            return self.error(429, f'Too Many Requests: retry after {retry_after}', {'retry_after': retry_after})
+
+        with server.lock:
+            if method == 'sendMessage':
+                message_id = len(server.messages) + 1
+                server.messages.append((time.monotonic(), chat_id, message_id, text))
+            else:
+                message_id = payload.get('message_id')
+                server.edits.append((time.monotonic(), chat_id, message_id, text))
+            server.counts[method] += 1
+        self.reply(200, json.dumps({'ok': True, 'result': {'message_id': message_id, 'chat': {'id': chat_id}}}).encode(),
+                   content_type='application/json')
+
+    def error(self, status, description, parameters=None):
+        result = {'ok': False, 'error_code': status, 'description': description}
+        if parameters:
+            result['parameters'] = parameters
+        self.reply(status, json.dumps(result).encode(), content_type='application/json')
+
+
+def load_bot(pcs, telegram, chats, state_dir):
+    """Carga el script apuntando a los servidores falsos mediante su configuración por entorno"""
+    os.environ.update({
+        'PROCYCLING_URL': pcs.url,
+        'TELEGRAM_API_URL': telegram.url,
+        'TELEGRAM_BOT_TOKEN': TELEGRAM_TOKEN,
+        'TELEGRAM_CHAT_ID': ','.join(chats),
+        'SUBSCRIPTIONS_FILE': os.path.join(state_dir, 'subscriptions.json'),
+        'HTTP_CACHE': '0',
+        'PROCYCLING_OFFLINE': '0',
+        'METRICS_PROM_FILE': '',
+        'METRICS_JSON_FILE': '',
+    })
+    return bot_loader.load_bot()
+
+
+def make_bot(bot, state_dir):
+    """Bot con el estado del escenario en un directorio temporal propio"""
+    bot.CACHE_FILE = os.path.join(state_dir, 'sent.json')
+    bot.SENT_RESULTS_DB = os.path.join(state_dir, 'sent.sqlite')
+    bot.RESULTS_DB = os.path.join(state_dir, 'results.sqlite')
+    bot.FETCH_STATE_FILE = os.path.join(state_dir, 'fetch_state.json')
+    bot.CIRCUIT_STATE_FILE = os.path.join(state_dir, 'circuits.json')
+    return bot.ProCyclingAlertBot()
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(bot, pcs, telegram, chats, name, overrides):
+    """Ejecuta las rondas del escenario y devuelve su informe"""
+    scenario = {**DEFAULT_SCENARIO, **overrides}
+    pcs.reset(scenario)
+    telegram.reset(scenario)
+    if scenario['tg_failing_chat'] is not None:
+        telegram.failing_chat = chats[scenario['tg_failing_chat']]
+    allowed_classes = set(bot.load_filters()[0])
+
+    first = scenario['races'] if scenario['first'] is None else scenario['first']
+    appeared = {}       # carrera -> ronda en la que aparece en la portada
+    round_starts = []
+    with tempfile.TemporaryDirectory(prefix='procycling-load-') as state_dir:
+        instance = make_bot(bot, state_dir)
+        try:
+            for round_number in range(scenario['rounds']):
+                visible = min(scenario['races'], first + round_number * scenario['step'])
+                for index in range(visible):
+                    appeared.setdefault(index, round_number)
+                pcs.visible = visible
+                pcs.round = telegram.round = round_number
+                layout = scenario['layout']
+                if round_number == 0 and scenario['late_podium']:
+                    layout = 'winner_only'
+                elif round_number == 0 and scenario['late_winner']:
+                    layout = 'no_podium'
+                pcs.homepage = generate_homepage(visible, layout, scenario['padding_kb'],
+                                                 round_number if scenario['shuffle'] else None)
+                round_starts.append(time.monotonic())
+                if scenario['pipeline']:
+                    instance.run_pipeline()
+                else:
+                    instance.run()
+            elapsed = time.monotonic() - round_starts[0]
+            http_stats = dict(instance.http.stats)
+        finally:
+            instance.close()
+
+    # Primera alerta de cada (chat, carrera) y repeticiones entre rondas
+    sent = Counter()
+    first_alert = {}
+    for at, chat_id, _, text in telegram.messages:
+        for index in {int(number) for number in RACE_NAME_PATTERN.findall(text)}:
+            sent[(chat_id, index)] += 1
+            first_alert.setdefault((chat_id, index), at)
+    expected = {(chat_id, index) for index in appeared for chat_id in chats
+                if race_class(index) in allowed_classes}
+    time_to_alert = [at - round_starts[appeared[index]] for (_, index), at in first_alert.items()]
+
+    return {
+        'scenario': name,
+        'description': scenario['description'],
+        'races': scenario['races'],
+        'rounds': scenario['rounds'],
+        'elapsed_s': round(elapsed, 2),
+        'pcs': dict(pcs.counts),
+        'bot_http': http_stats,
+        'telegram': dict(telegram.counts),
+        'time_to_alert_s': {
+            'first': round(min(time_to_alert, default=float('nan')), 3),
+            'p50': round(percentile(time_to_alert, 0.5), 3),
+            'p95': round(percentile(time_to_alert, 0.95), 3),
+            'max': round(max(time_to_alert, default=float('nan')), 3),
+        },
+        'dedupe': {
+            'expected': len(expected),
+            'delivered': len(expected & set(sent)),
+            'duplicates': sorted(f"{chat}:{index}" for (chat, index), count in sent.items() if count > 1),
+            'unexpected': sorted(f"{chat}:{index}" for chat, index in set(sent) - expected),
+            'missing': sorted(f"{chat}:{index}" for chat, index in expected - set(sent)),
+            # El contenido de las carreras no cambia entre rondas: ninguna edición está justificada
+            'edits': len(telegram.edits),
+        },
+    }
+
+
+def failures_of(report):
+    """Problemas de entrega del escenario (lista vacía si todo es correcto)"""
+    dedupe = report['dedupe']
+    problems = []
+    for key, label in (('duplicates', "duplicada(s)"), ('unexpected', "inesperada(s)"), ('missing', "sin enviar")):
+        if dedupe[key]:
+            problems.append(f"{len(dedupe[key])} alerta(s) {label}: {', '.join(dedupe[key][:5])}")
+    if dedupe['edits']:
+        problems.append(f"{dedupe['edits']} edición(es) sin cambios en el podio")
+    return problems
+
+
+def print_report(report, chats):
+    pcs = report['pcs']
+    http_stats = report['bot_http']
+    telegram = report['telegram']
+    alert = report['time_to_alert_s']
+    dedupe = report['dedupe']
+    print(f"\n▶ {report['scenario']}: {report['races']} carrera(s), {report['rounds']} ronda(s), "
+          f"{len(chats)} chat(s), {report['elapsed_s']:.1f}s — {report['description']}")
+    print(f"  PCS       portada {pcs.get('homepage', 0)} (200: {pcs.get('homepage_200', 0)}, "
+          f"304: {pcs.get('homepage_304', 0)}), páginas de carrera {pcs.get('race_page', 0)}, "
+          f"inyectados 429: {pcs.get('injected_429', 0)}, 5xx: {pcs.get('injected_5xx', 0)}")
+    print(f"  Bot HTTP  {http_stats['requests']} petición(es), {http_stats['retries']} reintento(s), "
+          f"{http_stats['failures']} fallo(s), {http_stats['circuit_rejections']} rechazada(s) por circuito")
+    print(f"  Telegram  {telegram.get('sendMessage', 0)} mensaje(s), {telegram.get('editMessageText', 0)} "
+          f"edición(es), {telegram.get('throttled', 0)} respuesta(s) 429, "
+          f"{telegram.get('failed_chat', 0)} error(es) inyectado(s)")
+    print(f"  Alerta    primera {alert['first']:.2f}s, p50 {alert['p50']:.2f}s, "
+          f"p95 {alert['p95']:.2f}s, máx {alert['max']:.2f}s")
+    problems = failures_of(report)
+    status = "✅" if not problems else "❌"
+    print(f"  Entrega   {status} {dedupe['delivered']}/{dedupe['expected']} alerta(s) esperada(s), "
+          f"{len(dedupe['duplicates'])} duplicada(s), {len(dedupe['unexpected'])} inesperada(s), "
+          f"{dedupe['edits']} edición(es)")
+    for problem in problems:
+        print(f"    - {problem}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="Escenario a ejecutar (se puede repetir; por defecto, todos)")
+    parser.add_argument('--chats', type=int, default=3, help="Chats suscritos")
+    parser.add_argument('--json', dest='json_file', help="Guarda los informes en este archivo JSON")
+    parser.add_argument('--verbose', action='store_true', help="Muestra el log del bot")
+    args = parser.parse_args()
+
+    pcs = FakeServer(FakePCSHandler).start()
+    telegram = FakeServer(FakeTelegramHandler).start()
+    chats = [str(-1001000000000 - n) for n in range(args.chats)]
+
+    with tempfile.TemporaryDirectory(prefix='procycling-load-') as config_dir:
+        bot = load_bot(pcs, telegram, chats, config_dir)
+        logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                            level=logging.INFO if args.verbose else logging.ERROR)
+
+        print(f"PCS falso en {pcs.url}, Bot API falsa en {telegram.url}")
+        reports = []
+        for name in args.scenario or SCENARIOS:
+            report = run_scenario(bot, pcs, telegram, chats, name, SCENARIOS[name])
+            print_report(report, chats)
+            reports.append(report)
+
+    pcs.shutdown()
+    telegram.shutdown()
+
+    if args.json_file:
+        with open(args.json_file, 'w') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f"\n✅ Informes guardados en {args.json_file}")
+
+    failed = [report['scenario'] for report in reports if failures_of(report)]
+    if failed:
+        print(f"\n❌ Escenario(s) con problemas de entrega: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n✅ Todas las alertas llegaron una sola vez")
+
+
+if __name__ == '__main__':
+    main()
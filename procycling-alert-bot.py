@@ -1,29 +1,77 @@
 import os
 import re
-import requests
-from bs4 import BeautifulSoup
+import sys
 import logging
 import json
 import hashlib
+import codecs
+import zlib
+import unicodedata
 import time
+import random
+import threading
+import argparse
+import importlib.util
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlparse, urljoin
+
+# El workflow arranca un intérprete nuevo en cada sondeo: los módulos pesados
+# (requests, bs4, sqlite3, asyncio, concurrent.futures...) se importan dentro
+# de la etapa que los usa. Una portada sin cambios termina sin cargar bs4.
 
-# Configuración del logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
-# URL de ProCyclingStats
-PROCYCLING_URL = "https://www.procyclingstats.com"
+def configure_logging():
+    """Configuración del logging (solo al ejecutar el script, no al importarlo)"""
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
 
-# Configuración de Telegram
+# URL de ProCyclingStats (se puede apuntar a un servidor local de pruebas)
+PROCYCLING_URL = os.getenv('PROCYCLING_URL', 'https://www.procyclingstats.com').rstrip('/')
+
+# API de Telegram (se puede apuntar a un servidor local de pruebas)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Configuración de Telegram. TELEGRAM_CHAT_ID admite varios chats separados por comas
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID', '')
+TELEGRAM_CHAT_IDS = [chat_id.strip() for chat_id in TELEGRAM_CHAT_ID.split(',') if chat_id.strip()]
+
+# Límites de la Bot API de Telegram
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+TELEGRAM_GLOBAL_RATE = 30.0   # Mensajes por segundo en total
+TELEGRAM_CHAT_RATE = 1.0      # Mensajes por segundo a un mismo chat
+TELEGRAM_GROUP_PER_MINUTE = 20  # Mensajes por minuto a un grupo o canal (chat_id negativo)
+TELEGRAM_SEND_CONCURRENCY = 4 # Chats atendidos a la vez
+
+# Cabecera de cada mensaje
+MESSAGE_HEADER = "· ProCycling Alert Bot ·\n\n"
 
-# Archivo para evitar duplicados
+# Archivo JSON antiguo para evitar duplicados (solo se lee para migrarlo)
 CACHE_FILE = '/tmp/procycling_sent_results.json'
 
+# Resultados enviados: SQLite en modo WAL junto al archivo antiguo
+SENT_RESULTS_DB = os.path.join(os.path.dirname(CACHE_FILE), 'procycling_sent_results.sqlite')
+SENT_RESULTS_TTL_DAYS = 400    # Algo más de una temporada
+SENT_RESULTS_MAX = 50000       # Tope de hashes guardados
+RACE_STATE_TTL_DAYS = 3        # Días que se sigue el podio de una carrera enviada para editar su mensaje
+
+# Histórico de resultados (todas las carreras extraídas, no solo las enviadas) para `query`
+RESULTS_DB = os.getenv('RESULTS_DB', os.path.join(os.path.dirname(CACHE_FILE), 'procycling_results.sqlite'))
+
+# Estado de la descarga condicional de la portada (ETag, Last-Modified y hash
+# de la sección 'Results today'), junto al archivo de caché
+FETCH_STATE_FILE = os.path.join(os.path.dirname(CACHE_FILE), 'procycling_fetch_state.json')
+
+# Estado del circuit breaker por host: con una ejecución nueva cada pocos
+# minutos (cron), los fallos tienen que acumularse entre procesos
+CIRCUIT_STATE_FILE = os.path.join(os.path.dirname(CACHE_FILE), 'procycling_circuits.json')
+
 # Headers para evitar bloqueos
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -34,7 +82,62 @@ HEADERS = {
     'Upgrade-Insecure-Requests': '1'
 }
 
-# Categorías de carreras permitidas (solo carreras importantes)
+# Cliente HTTP: reintentos, backoff y circuit breaker
+HTTP_TIMEOUT = 10
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 1.0      # Segundos del primer reintento (se duplica en cada intento)
+HTTP_BACKOFF_MAX = 30.0      # No esperamos más que esto entre reintentos
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+CIRCUIT_FAILURE_THRESHOLD = 5  # Fallos seguidos que abren el circuito de un host
+CIRCUIT_RESET_TIMEOUT = 300    # Segundos con el circuito abierto antes de volver a probar
+PCS_POOL_SIZE = 8
+TELEGRAM_POOL_SIZE = 4
+
+# Backends de parseo HTML en orden de preferencia: se usa el primero instalado.
+# HTML_PARSER permite forzar uno concreto ('lxml' o 'html.parser')
+PARSER_BACKENDS = ['lxml', 'html.parser']
+
+# En la página de una carrera solo materializamos la tabla de resultados y las
+# listas (ul.infolist); la ubicación junto a la bandera se saca del HTML sin parsear
+RACE_PAGE_TAGS = ('table', 'ul')
+FLAG_LOCATION = re.compile(r'<span[^>]*class="flag[^"]*"[^>]*>\s*</span>\s*([^<]+)')
+
+# Caché en disco de respuestas HTTP, junto al archivo de caché
+HTTP_CACHE_DIR = os.path.join(os.path.dirname(CACHE_FILE), 'procycling_http_cache')
+HTTP_CACHE_ENABLED = os.getenv('HTTP_CACHE', '1') == '1'
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', str(20 * 1024 * 1024)))
+HOMEPAGE_CACHE_TTL = 60              # La portada cambia a lo largo del día
+RACE_PAGE_CACHE_TTL = 15 * 60        # Página de carrera con resultados aún provisionales
+FINAL_RACE_PAGE_CACHE_TTL = 30 * 86400  # Carrera con podio completo: prácticamente inmutable
+
+# Backfill de días pasados: página de resultados de un día de PCS ({date} = AAAA-MM-DD)
+BACKFILL_DAY_URL = os.getenv('BACKFILL_DAY_URL', PROCYCLING_URL + '/races.php?date={date}')
+# Un checkpoint por modo: una vista previa sin --send no marca días como enviados
+BACKFILL_CHECKPOINT_FILE = os.path.join(os.path.dirname(CACHE_FILE), 'procycling_backfill_checkpoint_{mode}.json')
+BACKFILL_WORKERS = 3
+BACKFILL_RATE = 0.5     # Peticiones por segundo a PCS, para no abusar
+
+# Modo offline: todo sale del caché (sin red, sin enviar nada a Telegram y sin tocar el estado guardado)
+OFFLINE_MODE = os.getenv('PROCYCLING_OFFLINE', '0') == '1'
+
+# Enriquecimiento con la página de cada carrera (ubicación y tiempos que faltan)
+ENRICH_RACES = os.getenv('ENRICH_RACES', '1') == '1'
+RACE_PAGE_CONCURRENCY = int(os.getenv('RACE_PAGE_CONCURRENCY', '4'))  # Peticiones simultáneas por host
+ENRICH_DEADLINE = float(os.getenv('ENRICH_DEADLINE', '20'))           # Segundos para toda la etapa
+
+# Modo pipeline (--pipeline): capacidad de las colas entre etapas, que frena a la anterior si se llenan
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '8'))
+
+# Archivo JSON con los filtros: {"categories": [...], "specific_races": [...]}.
+# Si no existe se usan ALLOWED_CATEGORIES y SPECIFIC_RACES
+FILTERS_FILE = os.getenv('FILTERS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filters.json'))
+
+# Suscripciones por chat (JSON): {"subscriptions": [{"chat_id": ..., "categories": [...],
+# "races": [...], "riders": [...]}]}. Sin archivo, cada chat de TELEGRAM_CHAT_ID
+# recibe lo que permitan los filtros globales de FILTERS_FILE
+SUBSCRIPTIONS_FILE = os.getenv('SUBSCRIPTIONS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'subscriptions.json'))
+
+# Categorías de carreras permitidas por defecto (solo carreras importantes)
 ALLOWED_CATEGORIES = [
     'GT.A',      # Grand Tour stages type A
     'GT.B',      # Grand Tour stages type B
@@ -51,7 +154,7 @@ ALLOWED_CATEGORIES = [
     'CC.RR',     # Continental Championship Road Race
 ]
 
-# Carreras específicas permitidas (nombres exactos o parciales)
+# Carreras específicas permitidas por defecto (nombres exactos o parciales)
 # Útil para carreras inferiores (ej. 1.1) que queremos incluir explícitamente.
 SPECIFIC_RACES = [
     "Clásica Jaén Paraíso Interior",
@@ -59,48 +162,1411 @@ SPECIFIC_RACES = [
     # Añade aquí otras carreras específicas que quieras permitir
 ]
 
-def is_allowed_category(race_name):
-    """Verifica si la carrera pertenece a una categoría permitida o está en la lista blanca"""
-    
-    # 1. Chequeo por categorías permitidas
-    for category in ALLOWED_CATEGORIES:
-        if f'({category})' in race_name:
+# Descarga de la portada en streaming: se corta en cuanto termina 'Results today'
+STREAM_HOMEPAGE = os.getenv('STREAM_HOMEPAGE', '1') == '1'
+STREAM_CHUNK_SIZE = 16 * 1024
+# Texto previo a 'Results today' que se guarda por si el marcador no aparece y
+# hay que parsear la página entera; si se pasa, se descarta y se vuelve a pedir
+STREAM_PREFIX_LIMIT = 512 * 1024
+
+# Exportación de métricas de cada ejecución (vacío = desactivado)
+METRICS_PROM_FILE = os.getenv('METRICS_PROM_FILE', '')   # Formato textfile de Prometheus
+METRICS_JSON_FILE = os.getenv('METRICS_JSON_FILE', '')   # Resumen JSON
+
+# Intervalos de sondeo del modo daemon (segundos)
+POLL_INTERVAL_FAST = int(os.getenv('POLL_INTERVAL_FAST', '120'))    # Carreras aún incompletas
+POLL_INTERVAL_NORMAL = int(os.getenv('POLL_INTERVAL_NORMAL', '600'))  # Igual que el cron
+POLL_INTERVAL_IDLE = int(os.getenv('POLL_INTERVAL_IDLE', '1800'))   # Horas muertas
+
+# Horas muertas en UTC (inicio-fin), cuando no suele terminar ninguna carrera
+QUIET_HOURS = os.getenv('QUIET_HOURS', '22-9')
+
+# Límites de la sección 'Results today' en el HTML sin parsear
+RESULTS_SECTION_START = re.compile(r'<h3[^>]*>\s*Results today\s*</h3>', re.IGNORECASE)
+NEXT_SECTION_START = re.compile(r'<h3[\s>]', re.IGNORECASE)
+
+def extract_results_section(html):
+    """Devuelve el HTML de la sección 'Results today' (hasta el siguiente h3) o None"""
+    start = RESULTS_SECTION_START.search(html)
+    if not start:
+        return None
+    end = NEXT_SECTION_START.search(html, start.end())
+    return html[start.start():end.start() if end else len(html)]
+
+class ResultsSectionScanner:
+    """Localiza la sección 'Results today' en un HTML que llega troceado
+
+    Para buscar el marcador basta una cola corta (por si queda partido entre
+    dos trozos). Además, hasta `prefix_limit` caracteres se guarda lo leído
+    antes del marcador: si no llega a aparecer, page tiene la página completa
+    y no hace falta volver a descargarla. Pasado ese límite se descarta y
+    page queda en None. Después del encabezado solo se guarda la sección.
+    """
+    TAIL_SIZE = 1024
+
+    def __init__(self, prefix_limit=STREAM_PREFIX_LIMIT):
+        self.buffer = ""
+        self.started = False
+        self.scan_from = 0
+        self.section = None
+        self.page = None
+        self.prefix_limit = prefix_limit
+        self.skipped = []
+        self.skipped_size = 0
+
+    def feed(self, text):
+        """Añade un trozo; devuelve True cuando la sección está completa"""
+        if not self.started and self.skipped is not None:
+            self.skipped_size += len(text)
+            if self.skipped_size <= self.prefix_limit:
+                self.skipped.append(text)
+            else:
+                # Demasiado antes del marcador: la memoria no debe crecer con la página
+                self.skipped = None
+        self.buffer += text
+        if not self.started:
+            start = RESULTS_SECTION_START.search(self.buffer)
+            if not start:
+                self.buffer = self.buffer[-self.TAIL_SIZE:]
+                return False
+            self.started = True
+            self.skipped = []
+            self.buffer = self.buffer[start.start():]
+            self.scan_from = start.end() - start.start()
+
+        end = NEXT_SECTION_START.search(self.buffer, self.scan_from)
+        if end:
+            self.section = self.buffer[:end.start()]
             return True
-        if category in race_name:
+        # '<h3' + separador podría haber quedado a medias al final del trozo
+        self.scan_from = max(self.scan_from, len(self.buffer) - 4)
+        return False
+
+    def finish(self):
+        """Fin del documento: la sección, si empezó, llega hasta el final
+
+        Si no empezó, la página leída entera queda en page (o None si
+        superaba `prefix_limit`).
+        """
+        if self.started and self.section is None:
+            self.section = self.buffer
+        elif not self.started and self.skipped is not None:
+            self.page = ''.join(self.skipped)
+            self.skipped = []
+        return self.section
+
+def available_parser_backends():
+    """Backends de PARSER_BACKENDS instalados en este entorno"""
+    return [backend for backend in PARSER_BACKENDS
+            if backend == 'html.parser' or importlib.util.find_spec(backend)]
+
+HTML_PARSER = os.getenv('HTML_PARSER') or available_parser_backends()[0]
+
+def make_soup(markup, parse_only=None, parser=None):
+    """Crea el árbol con el backend configurado, opcionalmente restringido con un SoupStrainer"""
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(markup, parser or HTML_PARSER, parse_only=parse_only)
+
+@lru_cache(maxsize=None)
+def make_strainer(*names):
+    """SoupStrainer que solo deja pasar esas etiquetas"""
+    from bs4 import SoupStrainer
+    return SoupStrainer(list(names))
+
+def is_quiet_hour(now=None):
+    """Indica si la hora actual (UTC) cae dentro de QUIET_HOURS"""
+    try:
+        start, end = (int(h) for h in QUIET_HOURS.split('-'))
+    except ValueError:
+        return False
+    hour = (now or datetime.now(timezone.utc)).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+def next_poll_interval(incomplete_races, now=None):
+    """Calcula la espera hasta el siguiente sondeo según el estado de las carreras"""
+    if incomplete_races:
+        return POLL_INTERVAL_FAST
+    if is_quiet_hour(now):
+        return POLL_INTERVAL_IDLE
+    return POLL_INTERVAL_NORMAL
+
+def parse_retry_after(response):
+    """Segundos a esperar según Retry-After (o 'retry_after' de la API de Telegram)"""
+    value = response.headers.get('Retry-After')
+    if value:
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            from email.utils import parsedate_to_datetime
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+    try:
+        return float(response.json()['parameters']['retry_after'])
+    except Exception:
+        return None
+
+CHARSET_PATTERN = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+def response_encoding(headers):
+    """Codificación del charset de Content-Type o, si no lo indica, UTF-8
+
+    requests supone ISO-8859-1 para text/html sin charset, y PCS sirve UTF-8:
+    "Clásica Jaén" acabaría como "ClÃ¡sica JaÃ©n" y fuera de los filtros.
+    """
+    match = CHARSET_PATTERN.search(headers.get('Content-Type', ''))
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+def request_not_sent(error):
+    """El error de red ocurrió antes de enviar la petición: no se llegó a conectar con el host"""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+# Igual que requests.RequestException, los errores propios del cliente HTTP son OSError
+class CircuitOpenError(OSError):
+    """El circuito de un host está abierto y la petición no se llega a enviar"""
+
+class SentResultsStore:
+    """Hashes de resultados enviados en SQLite (WAL), con caducidad y tope de tamaño"""
+
+    def __init__(self, path):
+        import sqlite3
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sent_results ("
+            "hash TEXT PRIMARY KEY, sent_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sent_results_sent_at ON sent_results (sent_at)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Último estado enviado de cada carrera y mensajes de Telegram en los que aparece
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS race_state ("
+            "race_key TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS race_state_updated_at ON race_state (updated_at)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS race_messages ("
+            "chat_id TEXT NOT NULL, message_id INTEGER NOT NULL, race_key TEXT NOT NULL, "
+            "position INTEGER NOT NULL, sent_at REAL NOT NULL, "
+            "PRIMARY KEY (chat_id, message_id, race_key)) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS race_messages_race_key ON race_messages (race_key)")
+        self.conn.commit()
+
+    def __contains__(self, result_hash):
+        row = self.conn.execute("SELECT 1 FROM sent_results WHERE hash = ?", (result_hash,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM sent_results").fetchone()[0]
+
+    def add(self, result_hash, sent_at=None):
+        """Marca un hash como enviado; queda pendiente hasta commit()"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sent_results (hash, sent_at) VALUES (?, ?)",
+            (result_hash, sent_at or time.time())
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def get_race_state(self, race_key):
+        """Último estado enviado de la carrera ({race, location, podium}) o None"""
+        row = self.conn.execute("SELECT state FROM race_state WHERE race_key = ?", (race_key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_race_state(self, race_key, state):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO race_state (race_key, state, updated_at) VALUES (?, ?, ?)",
+            (race_key, json.dumps(state, ensure_ascii=False, separators=(',', ':')), time.time())
+        )
+
+    def add_message(self, chat_id, message_id, race_keys):
+        """Apunta qué carreras, y en qué orden, lleva un mensaje enviado"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO race_messages (chat_id, message_id, race_key, position, sent_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            ((str(chat_id), message_id, race_key, position, now) for position, race_key in enumerate(race_keys))
+        )
+
+    def remove_from_message(self, chat_id, message_id, race_keys):
+        """Deja de asociar esas carreras al mensaje (p. ej. porque su podio va ya en otro)"""
+        self.conn.executemany(
+            "DELETE FROM race_messages WHERE chat_id = ? AND message_id = ? AND race_key = ?",
+            ((str(chat_id), message_id, race_key) for race_key in race_keys)
+        )
+
+    def messages_for_race(self, race_key):
+        """Mensajes (chat_id, message_id) en los que se envió la carrera"""
+        return self.conn.execute(
+            "SELECT chat_id, message_id FROM race_messages WHERE race_key = ?", (race_key,)
+        ).fetchall()
+
+    def races_in_message(self, chat_id, message_id):
+        return [row[0] for row in self.conn.execute(
+            "SELECT race_key FROM race_messages WHERE chat_id = ? AND message_id = ? ORDER BY position",
+            (str(chat_id), message_id)
+        )]
+
+    def evict(self, ttl_days=SENT_RESULTS_TTL_DAYS, max_entries=SENT_RESULTS_MAX, state_ttl_days=RACE_STATE_TTL_DAYS):
+        """Elimina los hashes caducados y, si sobran, los más antiguos, y el estado de podios ya cerrados"""
+        with self.conn:
+            expired = self.conn.execute(
+                "DELETE FROM sent_results WHERE sent_at < ?", (time.time() - ttl_days * 86400,)
+            ).rowcount
+            overflow = self.conn.execute(
+                "DELETE FROM sent_results WHERE hash IN ("
+                "SELECT hash FROM sent_results ORDER BY sent_at DESC LIMIT -1 OFFSET ?)",
+                (max_entries,)
+            ).rowcount
+            state_limit = time.time() - state_ttl_days * 86400
+            states = self.conn.execute("DELETE FROM race_state WHERE updated_at < ?", (state_limit,)).rowcount
+            self.conn.execute("DELETE FROM race_messages WHERE sent_at < ?", (state_limit,))
+        if expired or overflow:
+            logger.info(f"Caché: {expired} hash(es) caducado(s) y {overflow} por exceso eliminados")
+        if states:
+            logger.info(f"Caché: estado de {states} carrera(s) caducado")
+
+    def migrate_json(self, json_path):
+        """Importa una sola vez el caché JSON antiguo (lista de hashes)"""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        imported = 0
+        if os.path.exists(json_path):
+            with open(json_path, 'r') as f:
+                hashes = json.load(f)
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO sent_results (hash, sent_at) VALUES (?, ?)",
+                ((result_hash, now) for result_hash in hashes)
+            )
+            imported = len(hashes)
+        self.conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+        self.conn.commit()
+        if imported:
+            logger.info(f"Migrados {imported} hash(es) desde {json_path}")
+
+    def close(self):
+        # Al cerrar la última conexión SQLite vuelca el WAL en la base de datos
+        self.conn.close()
+
+class ResultsStore:
+    """Histórico de carreras y podios en SQLite, indexado por fecha, categoría y ciclista"""
+
+    def __init__(self, path):
+        import sqlite3
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS races ("
+            "race_key TEXT PRIMARY KEY, race TEXT NOT NULL, race_class TEXT NOT NULL, "
+            "location TEXT NOT NULL, race_date TEXT NOT NULL, url TEXT NOT NULL, "
+            "updated_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS podiums ("
+            "race_key TEXT NOT NULL, pos INTEGER NOT NULL, rider TEXT NOT NULL, "
+            "rider_key TEXT NOT NULL, time TEXT NOT NULL, "
+            "PRIMARY KEY (race_key, pos)) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS races_date ON races (race_date)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS races_class_date ON races (race_class COLLATE NOCASE, race_date)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS podiums_rider ON podiums (rider_key, pos)")
+        self.conn.commit()
+
+    def save_races(self, races, race_date):
+        """Guarda (o actualiza, si el podio ha cambiado) las carreras en una sola transacción"""
+        now = time.time()
+        day = race_date.isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO races (race_key, race, race_class, location, race_date, url, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((race['key'], race['race'], race['race_class'], race.get('location', ''), day, race['url'], now)
+                 for race in races)
+            )
+            self.conn.executemany("DELETE FROM podiums WHERE race_key = ?", ((race['key'],) for race in races))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO podiums (race_key, pos, rider, rider_key, time) VALUES (?, ?, ?, ?, ?)",
+                ((race['key'], int(entry.pos), entry.rider, rider_key(entry.rider), entry.time)
+                 for race in races for entry in race['podium'] if entry.pos.isdigit())
+            )
+
+    def wins(self, rider, season=None):
+        """Victorias de un ciclista (fecha, carrera, nombre tal como aparece), de la más reciente a la más antigua"""
+        query = ("SELECT r.race_date, r.race, p.rider FROM podiums p JOIN races r ON r.race_key = p.race_key "
+                 "WHERE p.rider_key = ? AND p.pos = 1")
+        params = [rider_key(rider)]
+        if season:
+            query += " AND r.race_date BETWEEN ? AND ?"
+            params += [f"{season}-01-01", f"{season}-12-31"]
+        return self.conn.execute(query + " ORDER BY r.race_date DESC", params).fetchall()
+
+    def podiums(self, categories=None, limit=10):
+        """Últimas carreras (opcionalmente de unas categorías) con su podio"""
+        query = "SELECT race_key, race_date, race, location FROM races"
+        params = []
+        if categories:
+            query += f" WHERE race_class COLLATE NOCASE IN ({', '.join('?' * len(categories))})"
+            params += categories
+        races = self.conn.execute(query + " ORDER BY race_date DESC LIMIT ?", params + [limit]).fetchall()
+        results = []
+        for key, race_date, race, location in races:
+            podium = self.conn.execute(
+                "SELECT pos, rider, time FROM podiums WHERE race_key = ? ORDER BY pos", (key,)
+            ).fetchall()
+            results.append((race_date, race, location, podium))
+        return results
+
+    def close(self):
+        self.conn.close()
+
+class OfflineCacheMiss(OSError):
+    """En modo offline la URL pedida no está en el caché"""
+
+def cache_ttl_for(url):
+    """TTL del caché según el tipo de URL (0 = no se cachea)"""
+    if url.rstrip('/') == PROCYCLING_URL.rstrip('/'):
+        return HOMEPAGE_CACHE_TTL
+    if url.startswith(PROCYCLING_URL) and '/race/' in urlparse(url).path:
+        return RACE_PAGE_CACHE_TTL
+    if url.startswith(BACKFILL_DAY_URL.split('{')[0]):
+        return RACE_PAGE_CACHE_TTL
+    return 0
+
+class ResponseCache:
+    """Caché en disco de cuerpos HTTP por URL: comprimidos con zlib, con TTL y desalojo LRU por bytes"""
+
+    INDEX_NAME = 'index.json'
+
+    def __init__(self, directory, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.dirty = False
+        os.makedirs(directory, exist_ok=True)
+        self.index = self.load_index()
+
+    def load_index(self):
+        try:
+            with open(os.path.join(self.directory, self.INDEX_NAME), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Índice del caché HTTP ilegible, se empieza de cero: {e}")
+            return {}
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.z")
+
+    def get(self, url, allow_stale=False):
+        """Respuesta cacheada (requests.Response) o None si no está o ha caducado"""
+        with self.lock:
+            entry = self.index.get(url)
+            if not entry:
+                return None
+            if not allow_stale and time.time() - entry['stored_at'] > entry['ttl']:
+                return None
+            try:
+                with open(self.path_for(entry['key']), 'rb') as f:
+                    body = zlib.decompress(f.read())
+            except Exception as e:
+                logger.warning(f"Entrada del caché HTTP dañada para {url}: {e}")
+                self.index.pop(url, None)
+                self.dirty = True
+                return None
+            entry['accessed_at'] = time.time()
+            self.dirty = True
+
+        import requests
+        from requests.structures import CaseInsensitiveDict
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body
+        response._content_consumed = True
+        response.headers = CaseInsensitiveDict(entry.get('headers', {}))
+        response.encoding = response_encoding(response.headers)
+        response.url = url
+        response.from_cache = True
+        return response
+
+    def store(self, url, body, ttl, headers=None):
+        """Guarda el cuerpo de una respuesta y desaloja lo menos usado si se pasa del presupuesto"""
+        key = hashlib.sha1(url.encode()).hexdigest()
+        kept_headers = {name: value for name, value in (headers or {}).items()
+                        if name.lower() in ('content-type', 'etag', 'last-modified')}
+        if isinstance(body, str):
+            # Un texto ya decodificado se guarda en UTF-8, diga lo que diga el original
+            kept_headers = {name: value for name, value in kept_headers.items() if name.lower() != 'content-type'}
+            kept_headers['Content-Type'] = 'text/html; charset=utf-8'
+            body = body.encode('utf-8')
+        data = zlib.compress(body, 6)
+        with self.lock:
+            tmp_path = self.path_for(key) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path_for(key))
+            now = time.time()
+            self.index[url] = {'key': key, 'size': len(data), 'stored_at': now, 'accessed_at': now,
+                               'ttl': ttl, 'headers': kept_headers}
+            self.dirty = True
+            self.evict()
+
+    def extend(self, url, ttl):
+        """Cambia el TTL de una entrada (p. ej. cuando la carrera ya es definitiva)"""
+        with self.lock:
+            if url in self.index and self.index[url]['ttl'] != ttl:
+                self.index[url]['ttl'] = ttl
+                self.dirty = True
+
+    def evict(self):
+        """Desaloja por orden de último acceso hasta quedar dentro de max_bytes (con el lock tomado)"""
+        total = sum(entry['size'] for entry in self.index.values())
+        if total <= self.max_bytes:
+            return
+        for url, entry in sorted(self.index.items(), key=lambda item: item[1]['accessed_at']):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path_for(entry['key']))
+            except FileNotFoundError:
+                pass
+            total -= entry['size']
+            del self.index[url]
+
+    def flush(self):
+        """Escribe el índice si ha cambiado"""
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                index_path = os.path.join(self.directory, self.INDEX_NAME)
+                with open(index_path + '.tmp', 'w') as f:
+                    json.dump(self.index, f)
+                os.replace(index_path + '.tmp', index_path)
+                self.dirty = False
+            except Exception as e:
+                logger.error(f"No se pudo guardar el índice del caché HTTP: {e}")
+
+class HttpClient:
+    """Cliente HTTP compartido: sesión con keep-alive por host, reintentos y circuit breaker
+
+    Con circuit_file el estado de los circuitos se guarda en disco en cada
+    cambio, para que cuente entre ejecuciones sueltas y no solo en --daemon.
+    """
+
+    def __init__(self, cache=None, offline=False, circuit_file=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.cache = cache
+        self.offline = offline
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        # Un pool de conexiones persistentes para cada host que usamos
+        self.session.mount(PROCYCLING_URL, HTTPAdapter(pool_connections=1, pool_maxsize=PCS_POOL_SIZE))
+        self.session.mount(TELEGRAM_API_URL, HTTPAdapter(pool_connections=1, pool_maxsize=TELEGRAM_POOL_SIZE))
+        self.circuit_file = circuit_file
+        self.circuits = self.load_circuits()  # host -> {'failures': n, 'opened_at': t (time.time())}
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'circuit_rejections': 0,
+                      'bytes_downloaded': 0, 'cache_hits': 0}
+        self.status_codes = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        """GET que pasa antes por el caché en disco (el único origen en modo offline)"""
+        ttl = cache_ttl_for(url) if self.cache is not None else 0
+        if self.cache is not None and (ttl or self.offline):
+            cached = self.cache.get(url, allow_stale=self.offline)
+            if cached is not None:
+                with self.lock:
+                    self.stats['cache_hits'] += 1
+                return cached
+        if self.offline:
+            raise OfflineCacheMiss(f"{url} no está en el caché (modo offline)")
+
+        response = self.request('GET', url, **kwargs)
+        # Las respuestas en streaming no se leen enteras; quien las consume decide qué cachear
+        if ttl and response.status_code == 200 and not kwargs.get('stream'):
+            self.cache.store(url, response.content, ttl, response.headers)
+        return response
+
+    def post(self, url, **kwargs):
+        if self.offline:
+            raise OfflineCacheMiss(f"POST a {urlparse(url).netloc} no disponible en modo offline")
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """Petición con reintentos (backoff exponencial con jitter) y circuit breaker por host
+
+        Con deadline (instante de time.monotonic()) el timeout de cada intento
+        se recorta a lo que queda de plazo y no se reintenta si no cabe.
+        """
+        import requests
+        host = urlparse(url).netloc
+        # La petición de prueba de un circuito semiabierto no se reintenta
+        max_retries = 0 if self.check_circuit(host) else HTTP_MAX_RETRIES
+        deadline = kwargs.pop('deadline', None)
+        kwargs.setdefault('timeout', HTTP_TIMEOUT)
+        # Un POST solo se repite ante 429 o si no llegó a conectar: con 5xx o un
+        # error a mitad de petición el mensaje pudo haberse entregado
+        retry_statuses = RETRY_STATUS_CODES if method == 'GET' else {429}
+
+        attempt = 0
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise requests.Timeout(f"Plazo agotado antes de pedir {url}")
+                kwargs['timeout'] = min(HTTP_TIMEOUT, remaining)
+            with self.lock:
+                self.stats['requests'] += 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+                response.encoding = response_encoding(response.headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self.backoff_delay(attempt)
+                if (attempt >= max_retries or (method != 'GET' and not request_not_sent(e))
+                        or self.past_deadline(deadline, delay)):
+                    self.record_failure(host)
+                    raise
+                logger.warning(f"Error de conexión con {host} ({e}), reintento en {delay:.1f}s")
+            else:
+                with self.lock:
+                    self.status_codes[response.status_code] += 1
+                    if not kwargs.get('stream'):
+                        self.stats['bytes_downloaded'] += len(response.content)
+                if response.status_code not in retry_statuses:
+                    if response.status_code >= 500:
+                        self.record_failure(host)
+                    else:
+                        self.record_success(host)
+                    return response
+                if attempt >= max_retries:
+                    self.record_failure(host)
+                    return response
+                retry_after = parse_retry_after(response)
+                if retry_after is not None and retry_after > HTTP_BACKOFF_MAX:
+                    logger.warning(f"{host} pide esperar {retry_after:.0f}s, se abandona la petición")
+                    self.record_failure(host)
+                    return response
+                delay = retry_after if retry_after is not None else self.backoff_delay(attempt)
+                if self.past_deadline(deadline, delay):
+                    logger.warning(f"{host} respondió {response.status_code} y no queda plazo para reintentar")
+                    self.record_failure(host)
+                    return response
+                logger.warning(f"{host} respondió {response.status_code}, reintento en {delay:.1f}s")
+
+            attempt += 1
+            with self.lock:
+                self.stats['retries'] += 1
+            time.sleep(delay)
+
+    def past_deadline(self, deadline, delay=0):
+        """Esperar `delay` segundos dejaría el siguiente intento fuera de plazo"""
+        return deadline is not None and time.monotonic() + delay >= deadline
+
+    def backoff_delay(self, attempt):
+        """Backoff exponencial con jitter completo"""
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+    def load_circuits(self):
+        """Circuitos guardados por una ejecución anterior"""
+        if not self.circuit_file:
+            return {}
+        try:
+            with open(self.circuit_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el estado de los circuitos: {e}")
+            return {}
+
+    def save_circuits(self):
+        """Guarda los circuitos (con el lock tomado)"""
+        if not self.circuit_file:
+            return
+        try:
+            tmp_path = f"{self.circuit_file}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.circuits, f)
+            os.replace(tmp_path, self.circuit_file)
+        except Exception as e:
+            logger.error(f"No se pudo guardar el estado de los circuitos: {e}")
+
+    def check_circuit(self, host):
+        """Lanza CircuitOpenError si el host ha fallado demasiadas veces seguidas
+
+        Devuelve True si la petición es la de prueba de un circuito semiabierto.
+        """
+        with self.lock:
+            circuit = self.circuits.get(host)
+            if not circuit or circuit['opened_at'] is None:
+                return False
+            if time.time() - circuit['opened_at'] >= CIRCUIT_RESET_TIMEOUT:
+                # Semiabierto: dejamos pasar una petición de prueba
+                circuit['opened_at'] = None
+                circuit['failures'] = CIRCUIT_FAILURE_THRESHOLD - 1
+                self.save_circuits()
+                return True
+            self.stats['circuit_rejections'] += 1
+        raise CircuitOpenError(f"Circuito abierto para {host}, no se envían peticiones")
+
+    def record_bytes(self, count):
+        """Suma los bytes leídos de una respuesta en streaming"""
+        with self.lock:
+            self.stats['bytes_downloaded'] += count
+
+    def record_success(self, host):
+        with self.lock:
+            if self.circuits.pop(host, None) is not None:
+                self.save_circuits()
+
+    def record_failure(self, host):
+        with self.lock:
+            self.stats['failures'] += 1
+            circuit = self.circuits.setdefault(host, {'failures': 0, 'opened_at': None})
+            circuit['failures'] += 1
+            if circuit['failures'] >= CIRCUIT_FAILURE_THRESHOLD and circuit['opened_at'] is None:
+                circuit['opened_at'] = time.time()
+                logger.error(f"Circuito abierto para {host} tras {circuit['failures']} fallos seguidos")
+            self.save_circuits()
+
+    def connection_stats(self):
+        """Conexiones abiertas y reutilizadas por host según los pools de urllib3"""
+        stats = {}
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                host_stats = stats.setdefault(pool.host, {'connections': 0, 'reused': 0})
+                host_stats['connections'] += pool.num_connections
+                host_stats['reused'] += max(0, pool.num_requests - pool.num_connections)
+        return stats
+
+    def log_stats(self):
+        """Resume en el log los contadores del cliente"""
+        logger.info(f"HTTP: {self.stats['requests']} petición(es), {self.stats['retries']} reintento(s), "
+                    f"{self.stats['failures']} fallo(s), {self.stats['circuit_rejections']} rechazada(s) por circuito, "
+                    f"{self.stats['cache_hits']} servida(s) desde caché")
+        for host, host_stats in self.connection_stats().items():
+            logger.info(f"HTTP {host}: {host_stats['connections']} conexión(es), {host_stats['reused']} reutilizada(s)")
+
+# Clase de la carrera al final del nombre: "Tour de France (2.UWT)" -> "2.UWT"
+RACE_CLASS_PATTERN = re.compile(r'\(([^()]+)\)\s*$')
+
+def normalize_name(text):
+    """Pasa a minúsculas (casefold) y quita acentos para comparar nombres"""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+# Términos de un nombre: incluyen el punto para que '2.UWT' o 'GT.A' salgan enteros
+NAME_TOKEN_PATTERN = re.compile(r'[\w.]+')
+
+def name_tokens(text):
+    """Términos normalizados (sin acentos, en minúsculas) de un nombre"""
+    return NAME_TOKEN_PATTERN.findall(normalize_name(text))
+
+def extract_race_class(race_name):
+    """Extrae la clase UCI del nombre de la carrera (o '' si no aparece)"""
+    match = RACE_CLASS_PATTERN.search(race_name)
+    return match.group(1).strip() if match else ''
+
+class CategoryMatcher:
+    """Filtro de categorías y lista blanca compilado una sola vez en dos expresiones regulares
+
+    Usa la misma definición que SubscriptionIndex: el nombre se reduce a sus
+    name_tokens() y tanto las categorías como las carreras de la lista blanca
+    cuentan solo como términos o frases completas ('2.Pro' no vale dentro de
+    '12.Pro' ni de '2.ProX'; guiones y apóstrofos no cuentan).
+    """
+
+    def __init__(self, categories, specific_races):
+        self.categories = {category.casefold() for category in categories}
+        self.category_re = self.compile_phrases(self.categories)
+        self.race_re = self.compile_phrases(' '.join(name_tokens(name)) for name in specific_races)
+
+    def compile_phrases(self, phrases):
+        """Regex que encuentra cualquiera de las frases como términos completos (o None)"""
+        phrases = {phrase for phrase in phrases if phrase}
+        if not phrases:
+            return None
+        alternatives = '|'.join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+        return re.compile(rf'(?<![\w.])(?:{alternatives})(?![\w.])')
+
+    def matches(self, race_name, race_class=None):
+        """Indica si la carrera pertenece a una categoría permitida o está en la lista blanca"""
+        if race_class is None:
+            race_class = extract_race_class(race_name)
+        if race_class.casefold() in self.categories:
             return True
-            
-    # 2. Chequeo por lista de carreras específicas
-    for specific_race in SPECIFIC_RACES:
-        if specific_race.lower() in race_name.lower():
+        normalized = ' '.join(name_tokens(race_name))
+        if self.category_re and self.category_re.search(normalized):
             return True
-            
-    return False
+        return bool(self.race_re and self.race_re.search(normalized))
+
+def load_filters(path=FILTERS_FILE):
+    """Lee categorías y carreras permitidas de FILTERS_FILE (o los valores por defecto)"""
+    try:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                filters = json.load(f)
+            return filters.get('categories', ALLOWED_CATEGORIES), filters.get('specific_races', SPECIFIC_RACES)
+    except Exception as e:
+        logger.warning(f"No se pudieron cargar los filtros de {path}: {e}")
+    return ALLOWED_CATEGORIES, SPECIFIC_RACES
+
+@lru_cache(maxsize=None)
+def get_category_matcher():
+    """CategoryMatcher compartido, construido la primera vez que se necesita"""
+    return CategoryMatcher(*load_filters())
+
+def rider_key(rider):
+    """Clave de un ciclista que no depende del orden nombre/apellido"""
+    return ' '.join(sorted(name_tokens(rider)))
+
+class SubscriptionIndex:
+    """Suscripciones de todos los chats compiladas en índices invertidos
+
+    Enrutar una carrera son unas pocas búsquedas en diccionarios (clase,
+    términos del nombre y ciclistas del podio), sin recorrer los filtros
+    de cada chat.
+    """
+
+    def __init__(self, subscriptions):
+        self.chat_ids = []
+        self.by_category = defaultdict(set)   # categoría -> chats
+        self.by_token = defaultdict(list)     # término del nombre -> [(nombre normalizado, chat)]
+        self.by_rider = defaultdict(set)      # ciclista -> chats
+
+        for subscription in subscriptions:
+            chat_id = str(subscription['chat_id'])
+            if chat_id not in self.chat_ids:
+                self.chat_ids.append(chat_id)
+            for category in subscription.get('categories', []):
+                self.by_category[category.casefold()].add(chat_id)
+            for race in subscription.get('races', []):
+                tokens = name_tokens(race)
+                if tokens:
+                    # Se indexa por el término más largo, el más selectivo; el nombre
+                    # completo se comprueba solo para las carreras que lo contienen
+                    self.by_token[max(tokens, key=len)].append((' '.join(tokens), chat_id))
+            for rider in subscription.get('riders', []):
+                key = rider_key(rider)
+                if key:
+                    self.by_rider[key].add(chat_id)
+
+    def route(self, race):
+        """Chats a los que les interesa la carrera"""
+        chats = set()
+        race_class = race.get('race_class')
+        if race_class is None:
+            race_class = extract_race_class(race['race'])
+        chats.update(self.by_category.get(race_class.casefold(), ()))
+
+        tokens = name_tokens(race['race'])
+        normalized = None
+        for token in tokens:
+            # Las categorías también cuentan como término suelto dentro del nombre
+            chats.update(self.by_category.get(token, ()))
+            for phrase, chat_id in self.by_token.get(token, ()):
+                if chat_id in chats:
+                    continue
+                if normalized is None:
+                    normalized = f" {' '.join(tokens)} "
+                if f" {phrase} " in normalized:
+                    chats.add(chat_id)
+
+        if self.by_rider:
+            for entry in race.get('podium', ()):
+                chats.update(self.by_rider.get(rider_key(entry.rider), ()))
+        return chats
+
+def load_subscriptions(path=SUBSCRIPTIONS_FILE):
+    """Lee las suscripciones de SUBSCRIPTIONS_FILE (o una por chat con los filtros globales)"""
+    try:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('subscriptions', [])
+    except Exception as e:
+        logger.warning(f"No se pudieron cargar las suscripciones de {path}: {e}")
+    categories, specific_races = load_filters()
+    return [{'chat_id': chat_id, 'categories': categories, 'races': specific_races}
+            for chat_id in TELEGRAM_CHAT_IDS]
+
+@lru_cache(maxsize=None)
+def get_subscription_index():
+    """SubscriptionIndex compartido, construido la primera vez que se necesita"""
+    return SubscriptionIndex(load_subscriptions())
+
+class RunMetrics:
+    """Tiempos por etapa y contadores de una ejecución, exportables a Prometheus o JSON"""
+
+    def __init__(self, http=None):
+        self.started = time.time()
+        self.spans = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+        # Los contadores HTTP son de todo el proceso: se guarda el punto de partida
+        self.http = http
+        self.http_start = dict(http.stats) if http else {}
+        self.status_start = dict(http.status_codes) if http else {}
+
+    @contextmanager
+    def span(self, stage):
+        """Acumula el tiempo del bloque en la etapa indicada"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.spans[stage] += elapsed
+
+    def incr(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+
+    def summary(self):
+        """Resumen de la ejecución, con lo que ha hecho el cliente HTTP durante ella"""
+        summary = {
+            'started': self.started,
+            'duration_seconds': round(time.time() - self.started, 6),
+            'stages_seconds': {stage: round(seconds, 6) for stage, seconds in self.spans.items()},
+            'counters': dict(self.counters),
+        }
+        if self.http is not None:
+            summary['http'] = {name: value - self.http_start.get(name, 0)
+                               for name, value in self.http.stats.items()}
+            summary['http_status'] = {str(code): count - self.status_start.get(code, 0)
+                                      for code, count in self.http.status_codes.items()
+                                      if count > self.status_start.get(code, 0)}
+        return summary
+
+    def to_prometheus(self, summary):
+        """Texto en formato de exposición de Prometheus"""
+        lines = [
+            "# HELP procycling_run_duration_seconds Duración total de la ejecución",
+            "# TYPE procycling_run_duration_seconds gauge",
+            f"procycling_run_duration_seconds {summary['duration_seconds']}",
+            "# HELP procycling_run_timestamp_seconds Inicio de la ejecución",
+            "# TYPE procycling_run_timestamp_seconds gauge",
+            f"procycling_run_timestamp_seconds {summary['started']}",
+            "# HELP procycling_stage_seconds Tiempo por etapa",
+            "# TYPE procycling_stage_seconds gauge",
+        ]
+        lines += [f'procycling_stage_seconds{{stage="{stage}"}} {seconds}'
+                  for stage, seconds in sorted(summary['stages_seconds'].items())]
+        lines += [
+            "# HELP procycling_races Carreras por estado en la ejecución",
+            "# TYPE procycling_races gauge",
+        ]
+        lines += [f'procycling_races{{state="{name}"}} {value}'
+                  for name, value in sorted(summary['counters'].items())]
+        if 'http' in summary:
+            lines += ["# HELP procycling_http Contadores del cliente HTTP", "# TYPE procycling_http gauge"]
+            lines += [f'procycling_http{{counter="{name}"}} {value}' for name, value in sorted(summary['http'].items())]
+            lines += ["# HELP procycling_http_responses Respuestas HTTP por código", "# TYPE procycling_http_responses gauge"]
+            lines += [f'procycling_http_responses{{code="{code}"}} {count}'
+                      for code, count in sorted(summary['http_status'].items())]
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Escribe las métricas en METRICS_PROM_FILE y/o METRICS_JSON_FILE"""
+        summary = self.summary()
+        outputs = [(METRICS_PROM_FILE, lambda: self.to_prometheus(summary)),
+                   (METRICS_JSON_FILE, lambda: json.dumps(summary, indent=2) + "\n")]
+        for path, render in outputs:
+            if not path:
+                continue
+            try:
+                # Escritura atómica: el lector nunca ve un archivo a medias
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(render())
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logger.error(f"No se pudieron exportar las métricas a {path}: {e}")
+        return summary
+
+class TokenBucket:
+    """Limitador de ritmo: `rate` permisos por segundo con ráfagas de hasta `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta que haya un permiso disponible"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+def split_race_block(block, limit):
+    """Parte por líneas un bloque demasiado largo, cerrando y reabriendo el spoiler"""
+    pieces = []
+    current = ""
+    in_spoiler = False
+    for line in block.splitlines(keepends=True):
+        closing = "</tg-spoiler>\n" if in_spoiler else ""
+        if current and len(current) + len(line) + len(closing) > limit:
+            pieces.append(current + closing)
+            current = "<tg-spoiler>\n" if in_spoiler else ""
+        current += line
+        if line.startswith("<tg-spoiler>"):
+            in_spoiler = True
+        elif line.startswith("</tg-spoiler>"):
+            in_spoiler = False
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_message(blocks, limit=TELEGRAM_MAX_MESSAGE_LENGTH):
+    """Agrupa los bloques (texto, carrera) en mensajes que no superan `limit`, sin partir carreras
+
+    Devuelve una lista de (texto, carreras incluidas)
+    """
+    chunks = []
+    text, races = MESSAGE_HEADER, []
+    for block, race in blocks:
+        if races and len(text) + len(block) > limit:
+            chunks.append((text, races))
+            text, races = MESSAGE_HEADER, []
+        if len(MESSAGE_HEADER) + len(block) > limit:
+            # Una sola carrera no cabe: va en varios mensajes consecutivos
+            for piece in split_race_block(block, limit - len(MESSAGE_HEADER)):
+                if races and len(text) + len(piece) > limit:
+                    chunks.append((text, races))
+                    text, races = MESSAGE_HEADER, []
+                text += piece
+                races.append(race)
+            continue
+        text += block
+        races.append(race)
+    if races:
+        chunks.append((text, races))
+    return chunks
+
+class TelegramDelivery:
+    """Envía las carreras a varios chats: mensajes troceados, ritmo limitado y registro por chat"""
+
+    def __init__(self, http, format_race, subscriptions=None):
+        self.http = http
+        self.format_race = format_race
+        self._subscriptions = subscriptions
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
+        self.chat_buckets = {}  # chat_id -> limitadores que debe pasar cada mensaje a ese chat
+        self.lock = threading.Lock()
+
+    @property
+    def subscriptions(self):
+        """Suscripciones indicadas o, si no, las compartidas (se cargan al primer uso)"""
+        if self._subscriptions is None:
+            self._subscriptions = get_subscription_index()
+        return self._subscriptions
+
+    def acquire_chat(self, chat_id):
+        """Espera turno para el chat: 1 msg/s y, en grupos y canales, además 20 msg/min"""
+        with self.lock:
+            if chat_id not in self.chat_buckets:
+                buckets = [TokenBucket(TELEGRAM_CHAT_RATE, capacity=1)]
+                if str(chat_id).startswith('-'):
+                    buckets.append(TokenBucket(TELEGRAM_GROUP_PER_MINUTE / 60, capacity=TELEGRAM_GROUP_PER_MINUTE))
+                self.chat_buckets[chat_id] = buckets
+            buckets = self.chat_buckets[chat_id]
+        for bucket in buckets:
+            bucket.acquire()
+        self.global_bucket.acquire()
+
+    def send_message(self, chat_id, text):
+        """Envía un mensaje HTML a un chat respetando los límites de Telegram; devuelve su message_id o None"""
+        self.acquire_chat(chat_id)
+        try:
+            url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+            payload = {
+                'chat_id': chat_id,
+                'text': text, # Ya no limpiamos aquí porque construimos HTML validado
+                'parse_mode': 'HTML'
+            }
+            response = self.http.post(url, json=payload)
+
+            if response.status_code == 200:
+                logger.info(f"Mensaje enviado exitosamente a Telegram (chat {chat_id})")
+                return response.json()['result']['message_id']
+            else:
+                logger.error(f"Error al enviar mensaje a {chat_id}: {response.status_code} - {response.text}")
+                return None
+        except Exception as e:
+            logger.error(f"Error al enviar mensaje a Telegram (chat {chat_id}): {e}")
+            return None
+
+    def edit_message(self, chat_id, message_id, text):
+        """Sustituye el texto de un mensaje ya enviado (editMessageText)"""
+        self.acquire_chat(chat_id)
+        try:
+            url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/editMessageText"
+            payload = {
+                'chat_id': chat_id,
+                'message_id': message_id,
+                'text': text,
+                'parse_mode': 'HTML'
+            }
+            response = self.http.post(url, json=payload)
+
+            if response.status_code == 200:
+                logger.info(f"Mensaje {message_id} editado en Telegram (chat {chat_id})")
+                return True
+            # Telegram responde 400 si el texto ya es ese: no hay nada que corregir
+            if 'message is not modified' in response.text:
+                return True
+            logger.error(f"Error al editar el mensaje {message_id} de {chat_id}: {response.status_code} - {response.text}")
+            return False
+        except Exception as e:
+            logger.error(f"Error al editar el mensaje {message_id} en Telegram (chat {chat_id}): {e}")
+            return False
+
+    def deliver_to_chat(self, chat_id, chunks, messages=None):
+        """Envía en orden los trozos a un chat; devuelve los hashes de las carreras entregadas"""
+        delivered = set()
+        failed = set()
+        for text, chunk_races in chunks:
+            message_id = self.send_message(chat_id, text)
+            if message_id is not None:
+                delivered.update(race['hash'] for race in chunk_races)
+                if messages is not None:
+                    messages.append((chat_id, message_id, [race['key'] for race in chunk_races]))
+            else:
+                # Una carrera partida en varios mensajes solo cuenta si llegan todos
+                failed.update(race['hash'] for race in chunk_races)
+        return delivered - failed
+
+    def targets(self, race):
+        """Chats suscritos a la carrera (enrutada al extraerla o ahora)"""
+        if 'chats' not in race:
+            race['chats'] = self.subscriptions.route(race)
+        return race['chats']
+
+    def deliver(self, races, sent_results, messages=None):
+        """Reparte las carreras entre sus chats suscritos y devuelve {chat_id: hashes entregados}
+
+        Las carreras que un chat ya recibió en un envío parcial anterior
+        (clave 'chat_id:hash' en el caché) no se le vuelven a mandar. Los
+        chats que reciben las mismas carreras comparten el mensaje, que se
+        construye una sola vez. Si se pasa `messages`, se le añade
+        (chat_id, message_id, claves de carrera) por cada mensaje enviado.
+        """
+        if not TELEGRAM_BOT_TOKEN or not self.subscriptions.chat_ids:
+            logger.error("Telegram token o chat ID no configurados")
+            return {}
+
+        pending = defaultdict(list)
+        delivered = {}
+        for race in races:
+            for chat_id in self.targets(race):
+                # Lo entregado en envíos anteriores también cuenta
+                if f"{chat_id}:{race['hash']}" in sent_results:
+                    delivered.setdefault(chat_id, set()).add(race['hash'])
+                else:
+                    pending[chat_id].append(race)
+
+        # Un mensaje por cada conjunto distinto de carreras, no por chat
+        blocks = {}
+        chunks = {}
+        for chat_races in pending.values():
+            key = tuple(race['hash'] for race in chat_races)
+            if key not in chunks:
+                for race in chat_races:
+                    if race['hash'] not in blocks:
+                        blocks[race['hash']] = self.format_race(race)
+                chunks[key] = split_message([(blocks[race['hash']], race) for race in chat_races])
+        logger.info(f"{len(chunks)} mensaje(s) distinto(s) para {len(pending)} chat(s)")
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, min(len(pending), TELEGRAM_SEND_CONCURRENCY))) as executor:
+            futures = {chat_id: executor.submit(self.deliver_to_chat, chat_id,
+                                                chunks[tuple(race['hash'] for race in chat_races)], messages)
+                       for chat_id, chat_races in pending.items()}
+        for chat_id, future in futures.items():
+            delivered.setdefault(chat_id, set()).update(future.result())
+        return delivered
+
+    def fully_delivered(self, race, delivered):
+        """La carrera ha llegado a todos sus chats suscritos"""
+        targets = self.targets(race)
+        return bool(delivered) and all(race['hash'] in delivered.get(chat_id, ()) for chat_id in targets)
+
+def is_allowed_category(race_name, race_class=None):
+    """Verifica si la carrera pertenece a una categoría permitida o está en la lista blanca"""
+    return get_category_matcher().matches(race_name, race_class)
+
+# Piezas de un LI de 'Results today' y registros que salen del extractor
+Token = namedtuple('Token', ['kind', 'text', 'href'])
+PodiumEntry = namedtuple('PodiumEntry', ['pos', 'rider', 'time'])
+
+class RaceItem:
+    """Carrera extraída de un LI de la portada"""
+    __slots__ = ('race_name', 'location', 'href', 'podium')
+
+    def __init__(self, race_name, location, href, podium):
+        self.race_name = race_name
+        self.location = location
+        self.href = href
+        self.podium = podium
+
+# Nombre de carrera seguido de la ubicación: "... (CC)France"
+RACE_LOCATION_PATTERN = re.compile(r'(\([A-Z]{2,3}\))([A-Z])')
+
+# Reglas para los textos fuera de enlaces, en orden: la primera que encaja decide
+# el tipo. Si cambia el formato de la portada basta con añadir o cambiar una regla
+TOKEN_RULES = [
+    ('position', re.compile(r'^[123]$')),
+    ('time', re.compile(r'^(?:\d{1,2}:\d{2}(?::\d{2})?|-|,,)$')),   # 1:23, 12:34, 1:23:45, -, ,,
+    ('team', re.compile(r'^[A-Z0-9]{2,4}$')),                       # Abreviatura de equipo: UAD, TVL...
+]
+
+# Enlaces que no son ciclistas
+IGNORED_RIDER_TEXTS = {'view  results', 'view results', ''}
+
+class ResultsExtractor:
+    """Convierte cada LI de 'Results today' en un RaceItem recorriendo sus nodos una sola vez"""
+
+    def __init__(self, token_rules=None):
+        self.token_rules = token_rules or TOKEN_RULES
+
+    def classify(self, text):
+        """Tipo de un texto suelto según las reglas"""
+        for kind, pattern in self.token_rules:
+            if pattern.match(text):
+                return kind
+        return 'text'
+
+    def tokenize(self, item):
+        """Tokens del LI en orden: el primer enlace con texto es 'race', los demás 'link'"""
+        tokens = []
+        self.walk(item, tokens, None)
+        return tokens
+
+    def walk(self, node, tokens, link):
+        for child in node.children:
+            # Sin importar bs4: los textos (NavigableString) son los únicos nodos sin nombre
+            if child.name is None:
+                text = child.strip()
+                if not text:
+                    continue
+                if link is not None:
+                    link.append(text)
+                else:
+                    tokens.append(Token(self.classify(text), text, ''))
+            else:
+                if child.name == 'a' and link is None and child.get('href'):
+                    parts = []
+                    self.walk(child, tokens, parts)
+                    text = ''.join(parts)
+                    if text:
+                        has_race = any(token.kind == 'race' for token in tokens)
+                        tokens.append(Token('link' if has_race else 'race', text, child['href']))
+                else:
+                    self.walk(child, tokens, link)
+
+    def parse_podium(self, tokens):
+        """Máquina de estados del podio: posición, ciclista y tiempo (con equipo opcional entre medias)"""
+        podium = []
+        i = 0
+        count = len(tokens)
+        while i < count:
+            if tokens[i].kind == 'position' and i + 1 < count:
+                rider = tokens[i + 1].text
+                time_val = ""
+                next_idx = i + 2
+                if next_idx < count:
+                    if tokens[next_idx].kind == 'time':
+                        time_val = tokens[next_idx].text
+                        next_idx = i + 3
+                    elif next_idx + 1 < count and tokens[next_idx + 1].kind == 'time':
+                        # Hay equipo en i+2, tiempo en i+3
+                        time_val = tokens[next_idx + 1].text
+                        next_idx = i + 4
+                    else:
+                        next_idx = i + 3
+
+                if rider.lower() not in IGNORED_RIDER_TEXTS:
+                    clean_time = time_val if time_val not in ['-', ',,'] else ''
+                    podium.append(PodiumEntry(tokens[i].text, rider, clean_time))
+                i = next_idx
+                continue
+            i += 1
+        return podium
+
+    def extract(self, item):
+        """RaceItem del LI, o None si no tiene al menos carrera y un enlace más"""
+        tokens = self.tokenize(item)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("  Tokens del LI: %s", [(token.kind, token.text) for token in tokens])
+
+        links = [token for token in tokens if token.kind in ('race', 'link')]
+        if len(links) < 2:
+            return None
+
+        race_name = links[0].text
+        location = ""
+        match = RACE_LOCATION_PATTERN.search(race_name)
+        if match:
+            split_pos = match.start(2)
+            race_name, location = race_name[:split_pos], race_name[split_pos:]
+        return RaceItem(race_name, location, links[0].href, self.parse_podium(tokens))
 
 class ProCyclingAlertBot:
 
     def __init__(self):
         logger.info("ProCyclingAlertBot initialized")
-        self.sent_results = self.load_sent_results()
+        cache = ResponseCache(HTTP_CACHE_DIR) if HTTP_CACHE_ENABLED or OFFLINE_MODE else None
+        # La reproducción offline no hace peticiones ni toca el estado guardado
+        self.http = HttpClient(cache, offline=OFFLINE_MODE,
+                               circuit_file=None if OFFLINE_MODE else CIRCUIT_STATE_FILE)
+        self.metrics = RunMetrics(self.http)
+        self.extractor = ResultsExtractor()
+        self.delivery = TelegramDelivery(self.http, self.format_race)
+        # Los almacenes SQLite se abren al primer uso: una portada sin cambios no los necesita
+        self._sent_results = None
+        self._results = None
+        # En la reproducción offline no hay descarga anterior con la que comparar la sección
+        self.fetch_state = {} if OFFLINE_MODE else self.load_fetch_state()
+        # Estado de la última descarga, pendiente de confirmar tras procesarla
+        self.pending_fetch_state = None
+        # La portada no se pudo descargar o procesar en este sondeo
+        self.fetch_failed = False
+        # Carreras permitidas con podio todavía incompleto (para el modo daemon)
+        self.incomplete_races = 0
+        # Carreras permitidas del último análisis de la sección, para contar las incompletas
+        self.allowed_races = None
+        # Carreras ya enviadas que vuelven a aparecer, candidatas a editar su mensaje
+        self.updated_races = []
+        # Todas las carreras extraídas en la ejecución, para el histórico
+        self.parsed_races = []
+
+    @property
+    def sent_results(self):
+        if self._sent_results is None:
+            self._sent_results = self.load_sent_results()
+        return self._sent_results
+
+    @property
+    def results(self):
+        if self._results is None:
+            self._results = self.load_results()
+        return self._results
+
+    def close(self):
+        """Cierra los almacenes SQLite que se hayan llegado a abrir"""
+        for store in (self._sent_results, self._results):
+            if store is not None:
+                store.close()
 
     def load_sent_results(self):
-        """Carga los resultados ya enviados desde el archivo de caché"""
+        """Abre el almacén de resultados enviados (y migra el caché JSON antiguo)"""
+        if OFFLINE_MODE:
+            # La reproducción offline muestra el día entero y no toca el estado real
+            return SentResultsStore(':memory:')
+        try:
+            store = SentResultsStore(SENT_RESULTS_DB)
+        except Exception as e:
+            logger.warning(f"No se pudo abrir el caché, se usa uno en memoria: {e}")
+            return SentResultsStore(':memory:')
         try:
-            if os.path.exists(CACHE_FILE):
-                with open(CACHE_FILE, 'r') as f:
-                    return set(json.load(f))
-            return set()
+            store.migrate_json(CACHE_FILE)
         except Exception as e:
-            logger.warning(f"No se pudo cargar el caché: {e}")
-            return set()
+            store.rollback()
+            logger.warning(f"No se pudo migrar el caché JSON: {e}")
+        return store
 
     def save_sent_results(self):
-        """Guarda los resultados enviados en el archivo de caché"""
+        """Confirma de forma atómica los resultados marcados como enviados"""
         try:
-            with open(CACHE_FILE, 'w') as f:
-                json.dump(list(self.sent_results), f)
+            self.sent_results.commit()
+            self.sent_results.evict()
         except Exception as e:
             logger.error(f"No se pudo guardar el caché: {e}")
 
+    def load_results(self):
+        """Abre el histórico de resultados (o uno en memoria si no se puede)"""
+        try:
+            return ResultsStore(RESULTS_DB)
+        except Exception as e:
+            logger.warning(f"No se pudo abrir el histórico de resultados, se usa uno en memoria: {e}")
+            return ResultsStore(':memory:')
+
+    def save_results(self, races, race_date=None):
+        """Guarda en el histórico las carreras extraídas, de una vez por ejecución"""
+        if not races:
+            return
+        try:
+            self.results.save_races(races, race_date or date.today())
+            logger.info(f"{len(races)} carrera(s) guardada(s) en el histórico")
+        except Exception as e:
+            logger.error(f"No se pudo guardar el histórico de resultados: {e}")
+
+    def load_fetch_state(self):
+        """Carga el estado de la última descarga de la portada (ETag, Last-Modified, hash)"""
+        try:
+            if os.path.exists(FETCH_STATE_FILE):
+                with open(FETCH_STATE_FILE, 'r') as f:
+                    return json.load(f)
+            return {}
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el estado de descarga: {e}")
+            return {}
+
+    def save_fetch_state(self):
+        """Confirma y guarda el estado de la última descarga procesada correctamente"""
+        if not self.pending_fetch_state:
+            return
+        self.fetch_state = self.pending_fetch_state
+        self.pending_fetch_state = None
+        try:
+            with open(FETCH_STATE_FILE, 'w') as f:
+                json.dump(self.fetch_state, f)
+        except Exception as e:
+            logger.error(f"No se pudo guardar el estado de descarga: {e}")
+
+    def conditional_headers(self):
+        """Cabeceras If-None-Match / If-Modified-Since a partir del estado guardado"""
+        headers = {}
+        if self.fetch_state.get('etag'):
+            headers['If-None-Match'] = self.fetch_state['etag']
+        if self.fetch_state.get('last_modified'):
+            headers['If-Modified-Since'] = self.fetch_state['last_modified']
+        return headers
+
     def generate_result_hash(self, race, winner):
         """Genera un hash único para un resultado de carrera"""
         result_str = f"{race}:{winner}"
@@ -111,47 +1577,26 @@ class ProCyclingAlertBot:
         # En HTML mode, necesitamos escapar <, > y &
         return message.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
     
-    def send_telegram(self, message):
-        """Envía un mensaje a Telegram usando requests"""
-        if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-            logger.error("Telegram token o chat ID no configurados")
-            return False
-
-        try:
-            url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-            payload = {
-                'chat_id': TELEGRAM_CHAT_ID,
-                'text': message, # Ya no limpiamos aquí porque construimos HTML validado
-                'parse_mode': 'HTML'
-            }
-            response = requests.post(url, json=payload, timeout=10)
+    def scrape_race_podium(self, race_url, deadline=None):
+        """Extrae el podio (top 3) y ubicación de una carrera específica
 
-            if response.status_code == 200:
-                logger.info("Mensaje enviado exitosamente a Telegram")
-                return True
-            else:
-                logger.error(f"Error al enviar mensaje: {response.status_code} - {response.text}")
-                return False
-        except Exception as e:
-            logger.error(f"Error al enviar mensaje a Telegram: {e}")
-            return False
-
-    def scrape_race_podium(self, race_url):
-        """Extrae el podio (top 3) y ubicación de una carrera específica"""
+        Con deadline (instante de time.monotonic()) la descarga, reintentos
+        incluidos, no pasa de ese momento.
+        """
         try:
             logger.info(f"Scrapeando podio de: {race_url}")
-            response = requests.get(race_url, headers=HEADERS, timeout=10)
+            response = self.http.get(race_url, deadline=deadline)
             response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = make_soup(response.content, parse_only=make_strainer(*RACE_PAGE_TAGS))
 
             podium = []
             location = ""
 
             # Buscar la ubicación de la carrera
-            # Intentar encontrar el elemento que contiene la ubicación
-            location_elem = soup.find('span', class_='flag')
-            if location_elem and location_elem.parent:
-                location = location_elem.parent.get_text(strip=True)
+            # Intentar encontrar el texto que acompaña a la bandera
+            flag_match = FLAG_LOCATION.search(response.text)
+            if flag_match:
+                location = flag_match.group(1).strip()
 
             # Si no se encuentra, buscar en otros lugares comunes
             if not location:
@@ -170,13 +1615,15 @@ class ProCyclingAlertBot:
                 results_table = soup.find('tbody')
 
             if results_table:
-                rows = results_table.find_all('tr')[:3]  # Top 3
+                # Top 3 (las filas de cabecera no tienen celdas td)
+                rows = [row for row in results_table.find_all('tr') if row.find('td')][:3]
 
                 for idx, row in enumerate(rows, 1):
                     cols = row.find_all('td')
                     if len(cols) >= 2:
                         # Buscar el nombre del ciclista
-                        rider_link = row.find('a', href=lambda x: x and '/rider/' in x)
+                        # Los enlaces de PCS pueden ser relativos ('rider/...') o absolutos ('/rider/...')
+                        rider_link = row.find('a', href=lambda x: x and re.match(r'^(?:.*/)?rider/', x))
                         rider_name = rider_link.get_text(strip=True) if rider_link else ""
 
                         # Buscar el tiempo (usualmente en la última columna)
@@ -190,241 +1637,960 @@ class ProCyclingAlertBot:
                             })
                             logger.info(f"Podio {idx}º: {rider_name} - {time_col}")
 
+            # Con el podio completo la página ya no va a cambiar: se cachea mucho más tiempo
+            if self.http.cache is not None and len(podium) == 3 and all(p['time'] != '-' for p in podium):
+                self.http.cache.extend(race_url, FINAL_RACE_PAGE_CACHE_TTL)
+
             return location, podium
 
         except Exception as e:
             logger.error(f"Error al scrapear podio de {race_url}: {e}")
             return "", []
 
-    def scrape_today_winners(self):
-        """Extrae las carreras del día con sus podios completos desde ProCyclingStats"""
+    def build_race(self, race_item):
+        """Carrera lista para filtrar y enviar: clase, hash (carrera + ganador), clave y URL absoluta"""
+        first_rider = race_item.podium[0].rider if race_item.podium else ""
+        url = urljoin(PROCYCLING_URL + '/', race_item.href)
+        return {
+            'race': race_item.race_name,
+            'race_class': extract_race_class(race_item.race_name),
+            'location': race_item.location,
+            'podium': race_item.podium,
+            'hash': self.generate_result_hash(race_item.race_name, first_rider),
+            # La clave no depende del podio: identifica la carrera aunque cambie el ganador
+            'key': hashlib.md5(f"{url}|{race_item.race_name}".encode()).hexdigest(),
+            'url': url
+        }
+
+    def route_race(self, race):
+        """Apunta en la carrera sus chats suscritos e indica si alguno la quiere
+
+        Sin chats configurados se aplica el filtro global, para poder
+        probar el scraping (p. ej. en modo offline) sin Telegram.
+        """
+        subscriptions = self.delivery.subscriptions
+        race['chats'] = subscriptions.route(race)
+        if not subscriptions.chat_ids:
+            return is_allowed_category(race['race'], race['race_class'])
+        return bool(race['chats'])
+
+    def scrape_day_results(self, day):
+        """RaceItems de la página de resultados de un día pasado"""
+        url = BACKFILL_DAY_URL.format(date=day.isoformat())
+        response = self.http.get(url)
+        response.raise_for_status()
+        # Un día ya cerrado no cambia: su página se queda en caché mucho tiempo
+        if self.http.cache is not None and day < date.today():
+            self.http.cache.extend(url, FINAL_RACE_PAGE_CACHE_TTL)
+
+        # Misma estructura de LI que 'Results today'; si la página no tiene esa
+        # sección, se miran todos los LI cuyo primer enlace es una carrera
+        section = extract_results_section(response.text)
+        soup = make_soup(section or response.content, parse_only=None if section else make_strainer('ul'))
+        race_items = []
+        for item in soup.find_all('li'):
+            race_item = self.extractor.extract(item)
+            if race_item and 'race/' in race_item.href:
+                race_items.append(race_item)
+        return race_items
+
+    def read_homepage(self, response):
+        """Devuelve (sección 'Results today', página completa o None)
+
+        En streaming la conexión se cierra en cuanto aparece el final de la
+        sección. Si el marcador no aparece, la página ya se ha leído entera y
+        se devuelve esa misma, sin descargarla otra vez, salvo que supere
+        STREAM_PREFIX_LIMIT: entonces se pide una vez más sin streaming.
+        """
+        if not STREAM_HOMEPAGE:
+            return extract_results_section(response.text), response.text
+
+        scanner = ResultsSectionScanner()
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        received = 0
+        complete = False
         try:
-            logger.info(f"Conectando a {PROCYCLING_URL}...")
-            response = requests.get(PROCYCLING_URL, headers=HEADERS, timeout=10)
-            logger.info(f"Status code: {response.status_code}")
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            today_races = []
-
-            # Buscar el encabezado 'Results today'
-            results_header = soup.find('h3', string='Results today')
-
-            if not results_header:
-                logger.warning("No se encontró el encabezado 'Results today'")
-                # Mostrar algunos encabezados h3 encontrados para debugging
-                all_h3 = soup.find_all('h3')
-                if all_h3:
-                    logger.info(f"Encabezados h3 encontrados: {[h.get_text(strip=True) for h in all_h3[:5]]}")
-                return None, []
-
-            logger.info("✅ Encabezado 'Results today' encontrado")
-
-            # Buscar el elemento ul que sigue al encabezado
-            current_element = results_header.find_next_sibling()
-
-            # DEBUG: Mostrar qué elementos siguen al h3
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                received += len(chunk)
+                if scanner.feed(decoder.decode(chunk)):
+                    complete = True
+                    break
+            if not complete:
+                scanner.feed(decoder.decode(b'', final=True))
+        finally:
+            # Cerrar sin leer el resto: la conexión no vuelve al pool, pero no se descarga más
+            response.close()
+            self.http.record_bytes(received)
+
+        section = scanner.finish()
+        if section is not None:
+            logger.info(f"Sección 'Results today' leída en streaming ({received} bytes, "
+                        f"{'cortada al terminar la sección' if complete else 'hasta el final'})")
+            # De la portada solo se cachea la sección, que es lo único que se usa
+            if self.http.cache is not None and not getattr(response, 'from_cache', False):
+                self.http.cache.store(PROCYCLING_URL, section, HOMEPAGE_CACHE_TTL, response.headers)
+            return section, None
+
+        if scanner.page is not None:
+            logger.warning(f"Marcador 'Results today' no encontrado en streaming ({received} bytes), "
+                           "se usa la página completa")
+            return extract_results_section(scanner.page), scanner.page
+
+        logger.warning(f"Marcador 'Results today' no encontrado en {received} bytes, "
+                       "demasiado para guardarlos: se descarga la página completa")
+        full_response = self.http.get(PROCYCLING_URL)
+        full_response.raise_for_status()
+        return extract_results_section(full_response.text), full_response.text
+
+    def iter_today_races(self):
+        """Genera las carreras de 'Results today' según se extraen, sin filtrar
+
+        Al terminar la sección deja su estado en pending_fetch_state, que
+        run() confirma cuando las carreras nuevas se hayan enviado.
+        """
+        self.parsed_races = []
+        logger.info(f"Conectando a {PROCYCLING_URL}...")
+        with self.metrics.span('fetch'):
+            response = self.http.get(PROCYCLING_URL, headers=self.conditional_headers(),
+                                     stream=STREAM_HOMEPAGE)
+        logger.info(f"Status code: {response.status_code}")
+
+        # 304: la portada no ha cambiado desde la última descarga procesada
+        if response.status_code == 304:
+            response.close()
+            logger.info("Portada sin cambios (304 Not Modified), no hay nada nuevo")
+            return
+
+        if not response.ok:
+            response.close()
+        response.raise_for_status()
+
+        with self.metrics.span('fetch'):
+            section, page = self.read_homepage(response)
+
+        # Hash solo de la sección 'Results today': si es idéntica a la última
+        # procesada, nos ahorramos el parseo, el filtrado y el formateo
+        section_hash = hashlib.md5(section.encode()).hexdigest() if section else None
+        new_fetch_state = {
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+            'section_hash': section_hash or ''
+        }
+        if section_hash and section_hash == self.fetch_state.get('section_hash'):
+            logger.info("Sección 'Results today' sin cambios, se omite el análisis")
+            # Actualizamos ETag/Last-Modified para la próxima petición condicional
+            self.pending_fetch_state = new_fetch_state
+            return
+
+        with self.metrics.span('parse'):
+            if section:
+                # Solo se materializa la sección, no la portada entera
+                soup = make_soup(section)
+            else:
+                # Sin sección localizable: basta con los h3 para el diagnóstico
+                soup = make_soup(page, parse_only=make_strainer('h3'))
+
+        # Buscar el encabezado 'Results today'
+        results_header = soup.find('h3', string='Results today')
+
+        if not results_header:
+            logger.warning("No se encontró el encabezado 'Results today'")
+            # Mostrar algunos encabezados h3 encontrados para debugging
+            all_h3 = soup.find_all('h3')
+            if all_h3:
+                logger.info(f"Encabezados h3 encontrados: {[h.get_text(strip=True) for h in all_h3[:5]]}")
+            # Sin resultados no hay nada que enviar, pero el ETag/Last-Modified
+            # sí se guarda para que el siguiente sondeo pueda recibir un 304
+            self.pending_fetch_state = new_fetch_state
+            return
+
+        logger.info("✅ Encabezado 'Results today' encontrado")
+
+        # Buscar el elemento ul que sigue al encabezado
+        current_element = results_header.find_next_sibling()
+
+        # DEBUG: Mostrar qué elementos siguen al h3
+        if logger.isEnabledFor(logging.DEBUG):
             debug_element = results_header.find_next_sibling()
             elements_found = []
             for i in range(5):
                 if debug_element:
-                    elements_found.append(f"{debug_element.name}")
+                    elements_found.append(debug_element.name)
                     debug_element = debug_element.find_next_sibling()
-            logger.info(f"Elementos después de h3: {elements_found}")
-
-            # Extraer todas las carreras hasta encontrar el siguiente encabezado o fin de sección
-            races_checked = 0
-            while current_element:
-                # Si encontramos otro encabezado h3, terminamos
-                if current_element.name == 'h3':
-                    logger.info(f"Encontrado siguiente h3, terminando. Carreras revisadas: {races_checked}")
-                    break
+            logger.debug("Elementos después de h3: %s", elements_found)
+
+        # Extraer todas las carreras hasta encontrar el siguiente encabezado o fin de sección
+        races_checked = 0
+        self.allowed_races = []
+        while current_element:
+            # Si encontramos otro encabezado h3, terminamos
+            if current_element.name == 'h3':
+                logger.info(f"Encontrado siguiente h3, terminando. Carreras revisadas: {races_checked}")
+                break
+
+            if current_element.name == 'ul':
+                list_items = current_element.find_all('li')
+                logger.info(f"Encontrado UL con {len(list_items)} items")
+
+                for item in list_items:
+                    races_checked += 1
+                    self.metrics.incr('seen')
+
+                    # Necesitamos al menos 2 enlaces: carrera y ganador
+                    with self.metrics.span('extract'):
+                        race_item = self.extractor.extract(item)
+                        if race_item is None:
+                            continue
+                        race = self.build_race(race_item)
+                    logger.debug("  -> Carrera: %s, Podio: %s", race['race'], race['podium'])
+                    self.parsed_races.append(race)
+                    yield race
+
+            current_element = current_element.find_next_sibling()
+
+        # La sección se ha procesado entera: su estado se confirma en run()
+        # cuando las carreras nuevas se hayan enviado
+        self.pending_fetch_state = new_fetch_state
+
+    def accept_race(self, race):
+        """Aplica el filtro de suscripciones y el de ya enviadas; indica si hay que enviarla"""
+        race_name = race['race']
+        podium = race['podium']
+        with self.metrics.span('filter'):
+            allowed = self.route_race(race)
+
+        # El podio se cuenta como incompleto al final del sondeo, ya enriquecido
+        if allowed and self.allowed_races is not None:
+            self.allowed_races.append(race)
+
+        # Ya enviada a todos sus chats con otro podio (o el mismo): se revisa para
+        # editar su mensaje. Si solo llegó a algunos, sigue el camino normal para
+        # que deliver() se la mande a los que faltan
+        if allowed:
+            previous = self.sent_results.get_race_state(race['key'])
+            if previous is not None and self.state_hash(previous) in self.sent_results:
+                race['previous'] = previous
+                self.updated_races.append(race)
+                self.metrics.incr('deduped')
+                return False
 
-                # Buscar enlaces dentro del elemento actual
-                if current_element.name == 'ul':
-                    list_items = current_element.find_all('li')
-                    logger.info(f"Encontrado UL con {len(list_items)} items")
-
-                    for item in list_items:
-                        all_links = item.find_all('a', href=True)
-                        # Mostrar TODOS los enlaces para debug
-                        all_texts = [a.get_text(strip=True) for a in all_links]
-                        logger.info(f"  LI tiene {len(all_links)} enlaces: {all_texts}")
-
-                        # DEBUG: Mostrar todo el texto del LI para encontrar los tiempos
-                        full_text = item.get_text(separator='|', strip=True)
-                        logger.info(f"  Texto completo del LI: {full_text}")
-
-                        races_checked += 1
-
-                        # Extraer enlaces con texto (ignorar vacíos como iconos/banderas)
-                        links_with_text = []
-                        for link in all_links:
-                            text = link.get_text(strip=True)
-                            if text:
-                                links_with_text.append({'text': text, 'href': link.get('href', '')})
-
-                        # Necesitamos al menos 2 enlaces: carrera y ganador
-                        if len(links_with_text) >= 2:
-                            race_info = links_with_text[0]['text']  # Primer enlace = carrera + ubicación
-
-                            # Intentar separar nombre de carrera y ubicación
-                            # Buscar patrón donde termina con (CC), (WC), etc. seguido de ubicación
-                            race_name = race_info
-                            location = ""
-
-                            # Buscar patrones comunes de fin de nombre de carrera
-                            match = re.search(r'(\([A-Z]{2,3}\))([A-Z])', race_info)
-                            if match:
-                                split_pos = match.start(2)
-                                race_name = race_info[:split_pos]
-                                location = race_info[split_pos:]
-
-                            # Extraer podio con tiempos del texto completo
-                            # Formato puede variar:
-                            # - Carrera|1|Nombre|Tiempo|2|...
-                            # - Carrera|1|Nombre|Equipo|Tiempo|2|... (con abrev. de equipo como TBV, PGL)
-                            full_text = item.get_text(separator='|', strip=True)
-                            parts = full_text.split('|')
-
-                            def is_time_format(s):
-                                """Detecta si un string es un tiempo válido (MM:SS, H:MM:SS, -, ,,)"""
-                                if not s:
-                                    return False
-                                if s in ['-', ',,']:
-                                    return True
-                                # Formato tiempo: 1:23, 12:34, 1:23:45, etc.
-                                return bool(re.match(r'^\d{1,2}:\d{2}(:\d{2})?$', s))
-
-                            podium = []
-                            i = 0
-                            while i < len(parts):
-                                if parts[i] in ['1', '2', '3']:
-                                    pos = parts[i]
-                                    if i + 1 < len(parts):
-                                        rider = parts[i + 1]
-
-                                        # Buscar el tiempo (puede estar en i+2 o i+3 si hay equipo)
-                                        time_val = ""
-                                        next_idx = i + 2
-
-                                        if next_idx < len(parts):
-                                            if is_time_format(parts[next_idx]):
-                                                time_val = parts[next_idx]
-                                                next_idx = i + 3
-                                            elif next_idx + 1 < len(parts) and is_time_format(parts[next_idx + 1]):
-                                                # Hay equipo en i+2, tiempo en i+3
-                                                time_val = parts[next_idx + 1]
-                                                next_idx = i + 4
-                                            else:
-                                                next_idx = i + 3
-
-                                        if rider.lower() not in ['view  results', 'view results', '']:
-                                            clean_time = ''
-                                            if time_val and time_val not in ['-', ',,']:
-                                                clean_time = time_val
-                                            podium.append({
-                                                'pos': pos,
-                                                'rider': rider,
-                                                'time': clean_time
-                                            })
-                                        i = next_idx
-                                        continue
-                                i += 1
-
-                            logger.info(f"  -> Carrera: {race_name}, Podio: {podium}")
-
-                            # Generar hash único para esta combinación
-                            first_rider = podium[0]['rider'] if podium else ""
-                            result_hash = self.generate_result_hash(race_name, first_rider)
-
-                            # Solo agregar si no se ha enviado antes
-                            if result_hash not in self.sent_results:
-                                # APLICAR FILTRO DE CATEGORÍA
-                                if is_allowed_category(race_name):
-                                    today_races.append({
-                                        'race': race_name,
-                                        'location': location,
-                                        'podium': podium,
-                                        'hash': result_hash
-                                    })
-                                    logger.info(f"✅ Carrera agregada (Categoría válida): {race_name} - Podio: {podium}")
-                                else:
-                                    logger.info(f"🚫 Carrera ignorada por categoría: {race_name}")
-                            else:
-                                logger.info(f"Carrera ya enviada (omitida): {race_name}")
-
-                current_element = current_element.find_next_sibling()
+        # Solo agregar si no se ha enviado antes
+        if race['hash'] in self.sent_results:
+            self.metrics.incr('deduped')
+            logger.debug("Carrera ya enviada (omitida): %s", race_name)
+            return False
+        if not allowed:
+            self.metrics.incr('filtered')
+            logger.debug("🚫 Carrera sin chats suscritos: %s", race_name)
+            return False
+        self.metrics.incr('new')
+        logger.info(f"✅ Carrera agregada ({len(race['chats'])} chat(s)): {race_name} - Podio: {podium}")
+        return True
+
+    def scrape_today_winners(self):
+        """Extrae las carreras del día con sus podios completos desde ProCyclingStats"""
+        self.updated_races = []
+        self.fetch_failed = False
+        try:
+            today_races = [race for race in self.iter_today_races() if self.accept_race(race)]
+            self.prepare_updates()
 
             # Solo retornar mensaje si hay carreras nuevas
             if today_races:
-                result = "· ProCycling Alert Bot ·\n\n"
-
-                for race in today_races:
-                    # Nombre de la carrera en BOLD (HTML)
-                    clean_race = self.clean_message(race['race'])
-                    result += f"<b>{clean_race}</b>\n"
-
-                    # Ubicación si existe
-                    if race.get('location'):
-                        clean_loc = self.clean_message(race['location'])
-                        result += f"📍 {clean_loc}\n"
-
-                    result += "\n"
-
-                    # Podio con tiempos (OCULTO CON SPOILER)
-                    if race.get('podium'):
-                        result += "<tg-spoiler>\n"  # Inicio del spoiler
-                        for rider_info in race['podium'][:3]:
-                            pos = rider_info.get('pos', '?')
-                            rider = self.clean_message(rider_info.get('rider', ''))
-                            time = self.clean_message(rider_info.get('time', ''))
-                            if time:
-                                result += f"{pos}º - {rider}  {time}\n"
-                            else:
-                                result += f"{pos}º - {rider}\n"
-                        result += "</tg-spoiler>\n" # Fin del spoiler
-
-                    result += "\n"
-
-                return result, today_races
+                # Completar con la página de cada carrera lo que falte en la portada
+                with self.metrics.span('enrich'):
+                    self.enrich_races(today_races)
+                with self.metrics.span('format'):
+                    message = self.format_message(today_races)
+                return message, today_races
             else:
                 # Si no hay carreras nuevas, retornar None
                 logger.info("No hay carreras nuevas para enviar")
                 return None, []
 
-        except requests.RequestException as e:
+        except OSError as e:
+            # requests.RequestException, CircuitOpenError y OfflineCacheMiss
             logger.error(f"Error al obtener datos de ProCyclingStats: {e}")
+            self.fetch_failed = True
             return None, []
         except Exception as e:
             logger.error(f"Error inesperado: {e}")
+            self.fetch_failed = True
             return None, []
     
+    def needs_enrichment(self, race):
+        """La línea de la portada es ambigua: falta la ubicación o algún tiempo del podio"""
+        if not race.get('url'):
+            return False
+        if not race.get('location') or len(race['podium']) < 3:
+            return True
+        return not race['podium'][0].time
+
+    def merge_race_page(self, race, location, page_podium):
+        """Rellena los huecos de la carrera con los datos de su página"""
+        if not race.get('location') and location:
+            race['location'] = location
+
+        podium = {entry.pos: entry for entry in race['podium']}
+        for page_info in page_podium:
+            pos = str(page_info['position'])
+            page_time = page_info['time'] if page_info['time'] not in ['-', ',,'] else ''
+            if pos not in podium:
+                podium[pos] = PodiumEntry(pos, page_info['rider'], page_time)
+            elif not podium[pos].time and rider_key(podium[pos].rider) == rider_key(page_info['rider']):
+                # El tiempo solo vale si es del mismo ciclista (la página escribe el apellido en mayúsculas)
+                podium[pos] = podium[pos]._replace(time=page_time)
+        race['podium'] = [podium[pos] for pos in sorted(podium)]
+
+    def enrich_races(self, races):
+        """Descarga en paralelo las páginas de las carreras ambiguas, con límite por host y plazo total"""
+        pending = [race for race in races if self.needs_enrichment(race)]
+        if not ENRICH_RACES or not pending:
+            return
+
+        logger.info(f"Completando {len(pending)} carrera(s) con su página de resultados")
+        host_limits = {}
+        for race in pending:
+            host = urlparse(race['url']).netloc
+            if host not in host_limits:
+                host_limits[host] = threading.Semaphore(RACE_PAGE_CONCURRENCY)
+
+        # El plazo llega hasta las peticiones: sin él, las que siguen en curso
+        # (con sus reintentos) alargarían la ejecución aunque ya no se esperen
+        deadline = time.monotonic() + ENRICH_DEADLINE
+
+        def fetch(race):
+            with host_limits[urlparse(race['url']).netloc]:
+                return self.scrape_race_podium(race['url'], deadline)
+
+        from concurrent.futures import ThreadPoolExecutor, wait
+        executor = ThreadPoolExecutor(max_workers=min(len(pending), RACE_PAGE_CONCURRENCY * len(host_limits)))
+        futures = {executor.submit(fetch, race): race for race in pending}
+        done, not_done = wait(futures, timeout=ENRICH_DEADLINE)
+        # Lo que no haya llegado a tiempo se envía con los datos de la portada
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        for future in done:
+            location, page_podium = future.result()
+            self.merge_race_page(futures[future], location, page_podium)
+        if not_done:
+            logger.warning(f"{len(not_done)} página(s) de carrera sin respuesta en {ENRICH_DEADLINE}s, se usan los datos de la portada")
+
+    def race_state(self, race):
+        """Estado compacto de una carrera enviada, suficiente para volver a formatearla"""
+        return {
+            'race': race['race'],
+            'location': race.get('location', ''),
+            'podium': [list(entry) for entry in race['podium']],
+            # El hash que se marcó como enviado, calculado con la línea de la
+            # portada: el podio guardado puede venir ya completado con la
+            # página de la carrera y no sirve para recalcularlo
+            'hash': race['hash']
+        }
+
+    def state_hash(self, state):
+        """Hash con el que se marcó como enviada la carrera guardada en el estado"""
+        if 'hash' in state:
+            return state['hash']
+        # Estados guardados antes de llevar el hash: carrera + ganador del podio
+        winner = state['podium'][0][1] if state['podium'] else ""
+        return self.generate_result_hash(state['race'], winner)
+
+    def race_from_state(self, state):
+        return {
+            'race': state['race'],
+            'location': state['location'],
+            'podium': [PodiumEntry(*entry) for entry in state['podium']]
+        }
+
+    def fill_from_state(self, race, previous):
+        """Completa con el estado enviado lo que la portada ya no muestra (ubicación, tiempos)
+
+        Los ciclistas se comparan con rider_key(): la página de la carrera
+        escribe el apellido en mayúsculas y la portada no.
+        """
+        if not race.get('location') and previous['location']:
+            race['location'] = previous['location']
+        podium = {entry[0]: PodiumEntry(*entry) for entry in previous['podium']}
+        for entry in race['podium']:
+            old = podium.get(entry.pos)
+            if old and rider_key(old.rider) == rider_key(entry.rider) and not entry.time:
+                continue
+            podium[entry.pos] = entry
+        race['podium'] = [podium[pos] for pos in sorted(podium)]
+
+    def podium_changes(self, previous, race):
+        """Diferencias campo a campo entre el estado enviado y el actual"""
+        changes = []
+        if race.get('location', '') != previous['location']:
+            changes.append(f"ubicación: {previous['location'] or '-'} → {race.get('location') or '-'}")
+        old_podium = {entry[0]: PodiumEntry(*entry) for entry in previous['podium']}
+        for entry in race['podium']:
+            old = old_podium.get(entry.pos)
+            if old is None:
+                changes.append(f"{entry.pos}º: {entry.rider} {entry.time}".rstrip())
+            elif rider_key(old.rider) != rider_key(entry.rider):
+                changes.append(f"{entry.pos}º: {old.rider} → {entry.rider}")
+            elif old.time != entry.time:
+                changes.append(f"{entry.pos}º {entry.rider}: {old.time or '-'} → {entry.time or '-'}")
+        return changes
+
+    def prepare_updates(self):
+        """Se queda solo con las carreras ya enviadas cuyo podio ha cambiado de verdad"""
+        if not self.updated_races:
+            return
+        for race in self.updated_races:
+            self.fill_from_state(race, race['previous'])
+        with self.metrics.span('enrich'):
+            self.enrich_races(self.updated_races)
+        changed = []
+        for race in self.updated_races:
+            race['changes'] = self.podium_changes(race['previous'], race)
+            if race['changes']:
+                changed.append(race)
+        self.updated_races = changed
+
+    def record_messages(self, races, delivered, messages):
+        """Guarda los mensajes enviados y el estado de las carreras que llegaron a todos sus chats
+
+        Con una entrega parcial no se guarda estado: la carrera tiene que
+        volver a pasar por deliver() en el siguiente sondeo, no por la edición.
+        """
+        for chat_id, message_id, race_keys in messages:
+            self.sent_results.add_message(chat_id, message_id, race_keys)
+        for race in races:
+            if self.delivery.fully_delivered(race, delivered):
+                self.sent_results.save_race_state(race['key'], self.race_state(race))
+
+    def send_updates(self):
+        """Edita los mensajes de las carreras cuyo podio ha cambiado; indica si se editaron todos"""
+        if not self.updated_races:
+            return True
+
+        states = {}
+        edits = set()
+        for race in self.updated_races:
+            logger.info(f"✏️ Podio actualizado en {race['race']}: {'; '.join(race['changes'])}")
+            states[race['key']] = self.race_state(race)
+            edits.update(self.sent_results.messages_for_race(race['key']))
+
+        failed_keys = set()
+        for chat_id, message_id in sorted(edits):
+            race_keys = self.sent_results.races_in_message(chat_id, message_id)
+            # El mensaje se rehace entero con el estado actual de todas sus carreras
+            message_states = [states.get(key) or self.sent_results.get_race_state(key) for key in race_keys]
+            if None in message_states:
+                logger.warning(f"Mensaje {message_id} (chat {chat_id}) con carreras ya caducadas, no se edita")
+                continue
+            text = self.format_message([self.race_from_state(state) for state in message_states])
+            if len(text) > TELEGRAM_MAX_MESSAGE_LENGTH:
+                # No cabe al editarlo: lo que ha cambiado sale en un mensaje nuevo, que
+                # pasa a ser el de esas carreras para las siguientes ediciones
+                changed_keys = [key for key in race_keys if key in states]
+                logger.warning(f"Mensaje {message_id} (chat {chat_id}) demasiado largo para editarlo, "
+                               f"se envían sus {len(changed_keys)} podio(s) actualizado(s) en uno nuevo")
+                text = self.format_message([self.race_from_state(states[key]) for key in changed_keys])
+                new_message_id = None
+                if len(text) <= TELEGRAM_MAX_MESSAGE_LENGTH:
+                    new_message_id = self.delivery.send_message(chat_id, text)
+                if new_message_id is None:
+                    failed_keys.update(changed_keys)
+                    continue
+                self.sent_results.remove_from_message(chat_id, message_id, changed_keys)
+                self.sent_results.add_message(chat_id, new_message_id, changed_keys)
+                continue
+            if not self.delivery.edit_message(chat_id, message_id, text):
+                failed_keys.update(race_keys)
+
+        # Lo que no se pudo editar conserva su estado anterior y se reintenta en el siguiente sondeo
+        for race in self.updated_races:
+            if race['key'] in failed_keys:
+                continue
+            self.sent_results.save_race_state(race['key'], states[race['key']])
+            self.sent_results.add(race['hash'])
+            self.metrics.incr('updated')
+        logger.info(f"{len(edits)} mensaje(s) editado(s) por {len(self.updated_races)} podio(s) actualizado(s)")
+        return not failed_keys
+
+    def format_race(self, race):
+        """Bloque HTML de una carrera: nombre, ubicación y podio oculto en spoiler"""
+        # Nombre de la carrera en BOLD (HTML)
+        clean_race = self.clean_message(race['race'])
+        result = f"<b>{clean_race}</b>\n"
+
+        # Ubicación si existe
+        if race.get('location'):
+            clean_loc = self.clean_message(race['location'])
+            result += f"📍 {clean_loc}\n"
+
+        result += "\n"
+
+        # Podio con tiempos (OCULTO CON SPOILER)
+        if race.get('podium'):
+            result += "<tg-spoiler>\n"  # Inicio del spoiler
+            for entry in race['podium'][:3]:
+                pos = entry.pos
+                rider = self.clean_message(entry.rider)
+                time = self.clean_message(entry.time)
+                if time:
+                    result += f"{pos}º - {rider}  {time}\n"
+                else:
+                    result += f"{pos}º - {rider}\n"
+            result += "</tg-spoiler>\n" # Fin del spoiler
+
+        result += "\n"
+        return result
+
+    def format_message(self, races):
+        """Construye el mensaje de Telegram con todas las carreras"""
+        result = MESSAGE_HEADER
+        for race in races:
+            result += self.format_race(race)
+        return result
+
+    def begin_poll(self):
+        """Reinicia el estado de un sondeo: en modo daemon la instancia se reutiliza"""
+        self.metrics = RunMetrics(self.http)
+        # Lo que quedó pendiente de un sondeo anterior no se puede confirmar con este
+        self.pending_fetch_state = None
+        self.allowed_races = None
+
+    def count_incomplete(self):
+        """Cuenta las carreras permitidas cuyo podio sigue provisional tras enriquecerlas
+
+        Si la sección no se ha analizado (304 o sin cambios) se mantiene la
+        cuenta del sondeo anterior.
+        """
+        if self.allowed_races is None:
+            return
+        # Podio sin completar o sin tiempo del ganador: resultado provisional
+        self.incomplete_races = sum(1 for race in self.allowed_races
+                                    if len(race['podium']) < 3 or not race['podium'][0].time)
+
     def run(self):
         """Ejecuta el bot y envía resultados por Telegram solo si hay carreras nuevas"""
         logger.info("Bot ejecutándose - buscando carreras del día")
+        self.begin_poll()
 
         # Obtener carreras de hoy con sus podios
         races_info, races_list = self.scrape_today_winners()
 
+        if OFFLINE_MODE:
+            # Reproducción desde el caché: se muestra el resultado sin enviar ni guardar nada
+            logger.info(races_info or "Sin carreras nuevas en la reproducción offline")
+            self.http.log_stats()
+            return
+
         # Solo enviar mensaje si hay carreras nuevas
         if races_info and races_list:
             # Mostrar en logs
             logger.info(f"Encontradas {len(races_list)} carrera(s) nueva(s)")
             logger.info(races_info)
 
-            # Enviar por Telegram
-            if self.send_telegram(races_info):
-                # Marcar resultados como enviados
-                for race in races_list:
-                    self.sent_results.add(race['hash'])
+            # Enviar por Telegram a todos los chats
+            messages = []
+            with self.metrics.span('send'):
+                delivered = self.delivery.deliver(races_list, self.sent_results, messages)
 
-                # Guardar el caché actualizado
-                self.save_sent_results()
-                logger.info(f"{len(races_list)} nueva(s) carrera(s) enviada(s) y guardada(s) en caché")
+            complete = self.mark_delivered(races_list, delivered)
+            self.record_messages(races_list, delivered, messages)
+
+            # Guardar el caché actualizado
+            self.save_sent_results()
+            self.metrics.incr('sent', complete)
+            all_sent = complete == len(races_list)
+            logger.info(f"{complete}/{len(races_list)} nueva(s) carrera(s) enviada(s) a todos sus chats y guardada(s) en caché")
         else:
             logger.info("No se envió mensaje porque no hay carreras nuevas")
+            all_sent = True
+
+        # Podios que han cambiado desde que se enviaron: se edita su mensaje
+        if self.updated_races:
+            with self.metrics.span('send'):
+                all_sent = self.send_updates() and all_sent
+            self.save_sent_results()
+        self.count_incomplete()
+
+        # Si la portada falló, el estado pendiente no corresponde a nada procesado
+        if all_sent and not self.fetch_failed:
+            self.save_fetch_state()
+        self.save_results(self.parsed_races)
+
+        if self.http.cache is not None:
+            self.http.cache.flush()
+        self.http.log_stats()
+        self.metrics.export()
+
+    def mark_delivered(self, races, delivered):
+        """Apunta en el caché lo entregado y devuelve cuántas carreras llegaron a todos sus chats
+
+        Una carrera queda enviada cuando ha llegado a todos sus chats; si solo
+        llegó a algunos, se apunta por chat para no repetírsela a esos.
+        """
+        complete = 0
+        for race in races:
+            if self.delivery.fully_delivered(race, delivered):
+                self.sent_results.add(race['hash'])
+                complete += 1
+            else:
+                for chat_id, hashes in delivered.items():
+                    if race['hash'] in hashes:
+                        self.sent_results.add(f"{chat_id}:{race['hash']}")
+        return complete
+
+    async def pipeline(self):
+        """Extracción, filtro, enriquecimiento y envío como etapas unidas por colas acotadas
+
+        Cada carrera se envía en cuanto está lista y se confirma en el caché al
+        momento. Lo que se acumula en la cola mientras sale un envío va junto
+        en el siguiente, troceado con split_message, para no gastar un mensaje
+        por carrera (los grupos admiten 20 por minuto). Las peticiones HTTP siguen pasando
+        por HttpClient (reintentos, circuito y caché) en hilos aparte.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        enrich_workers = max(1, RACE_PAGE_CONCURRENCY)
+        extracted = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        accepted = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        ready = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        started = time.monotonic()
+        totals = {'new': 0, 'complete': 0, 'extract_failed': False}
+        self.updated_races = []
+
+        def produce():
+            # El generador corre en un hilo; si la cola está llena, espera al filtro
+            for race in self.iter_today_races():
+                asyncio.run_coroutine_threadsafe(extracted.put(race), loop).result()
+
+        async def extract():
+            try:
+                await asyncio.to_thread(produce)
+            except Exception as e:
+                totals['extract_failed'] = True
+                logger.error(f"Error al obtener datos de ProCyclingStats: {e}")
+            finally:
+                await extracted.put(None)
+
+        async def filter_races():
+            # El filtro consulta el caché SQLite, así que se queda en el hilo del bucle
+            while (race := await extracted.get()) is not None:
+                if self.accept_race(race):
+                    totals['new'] += 1
+                    await accepted.put(race)
+            for _ in range(enrich_workers):
+                await accepted.put(None)
+
+        async def enrich():
+            while (race := await accepted.get()) is not None:
+                if ENRICH_RACES and self.needs_enrichment(race):
+                    try:
+                        with self.metrics.span('enrich'):
+                            location, page_podium = await asyncio.wait_for(
+                                asyncio.to_thread(self.scrape_race_podium, race['url'],
+                                                  time.monotonic() + ENRICH_DEADLINE), ENRICH_DEADLINE)
+                        self.merge_race_page(race, location, page_podium)
+                    except asyncio.TimeoutError:
+                        logger.warning(f"Página de {race['race']} sin respuesta en {ENRICH_DEADLINE}s, se usan los datos de la portada")
+                await ready.put(race)
+            await ready.put(None)
+
+        async def deliver():
+            finished = 0
+            while finished < enrich_workers:
+                # Espera a la primera carrera y se lleva también las que ya estén en cola
+                batch = [await ready.get()]
+                while not ready.empty():
+                    batch.append(ready.get_nowait())
+                finished += batch.count(None)
+                races = [race for race in batch if race is not None]
+                if not races:
+                    continue
+                if OFFLINE_MODE:
+                    logger.info(self.format_message(races))
+                    continue
+
+                # El caché no sale del hilo del bucle: al envío solo le llegan sus claves por chat
+                keys = (f"{chat_id}:{race['hash']}" for race in races for chat_id in self.delivery.targets(race))
+                sent_keys = {key for key in keys if key in self.sent_results}
+                messages = []
+                with self.metrics.span('send'):
+                    delivered = await asyncio.to_thread(self.delivery.deliver, races, sent_keys, messages)
+                complete = self.mark_delivered(races, delivered)
+                self.record_messages(races, delivered, messages)
+                self.sent_results.commit()
+                if complete and not totals['complete']:
+                    logger.info(f"Primera alerta enviada a los {time.monotonic() - started:.2f}s")
+                totals['complete'] += complete
+
+        await asyncio.gather(extract(), filter_races(), *(enrich() for _ in range(enrich_workers)), deliver())
+        return totals
+
+    def run_pipeline(self):
+        """Como run(), pero cada carrera avanza por las etapas sin esperar a las demás"""
+        logger.info("Bot ejecutándose en modo pipeline - buscando carreras del día")
+        import asyncio
+        self.begin_poll()
+        totals = asyncio.run(self.pipeline())
+
+        if OFFLINE_MODE:
+            # Reproducción desde el caché: las carreras ya se han mostrado, sin enviar ni guardar nada
+            self.http.log_stats()
+            return
+
+        # Las ediciones de podios cambiados van al final, cuando ya ha salido todo lo nuevo
+        self.prepare_updates()
+        with self.metrics.span('send'):
+            updated = self.send_updates()
+        self.save_sent_results()
+        self.count_incomplete()
+        self.metrics.incr('sent', totals['complete'])
+        # La portada solo se da por procesada si todo lo nuevo llegó a sus chats
+        if not totals['extract_failed'] and totals['complete'] == totals['new'] and updated:
+            self.save_fetch_state()
+        self.save_results(self.parsed_races)
+        logger.info(f"{totals['complete']}/{totals['new']} nueva(s) carrera(s) enviada(s) a todos sus chats y guardada(s) en caché")
+
+        if self.http.cache is not None:
+            self.http.cache.flush()
+        self.http.log_stats()
+        self.metrics.export()
+
+    def run_daemon(self, pipeline=False):
+        """Mantiene el bot vivo y sondea con un intervalo adaptativo"""
+        logger.info("Modo daemon iniciado")
+        while True:
+            try:
+                if pipeline:
+                    self.run_pipeline()
+                else:
+                    self.run()
+            except Exception as e:
+                logger.error(f"Error en la ejecución del daemon: {e}")
+
+            interval = next_poll_interval(self.incomplete_races)
+            logger.info(f"Próximo sondeo en {interval}s ({self.incomplete_races} carrera(s) incompleta(s))")
+            time.sleep(interval)
+
+class BackfillCrawler:
+    """Recorre días pasados de PCS con un pool acotado, ritmo limitado y checkpoint para reanudar"""
+
+    def __init__(self, bot, workers=BACKFILL_WORKERS, rate=BACKFILL_RATE, send=False,
+                 checkpoint_file=None, restart=False):
+        self.bot = bot
+        self.workers = workers
+        self.bucket = TokenBucket(rate, capacity=1)
+        self.send = send
+        self.checkpoint_file = checkpoint_file or BACKFILL_CHECKPOINT_FILE.format(mode='send' if send else 'preview')
+        # Con restart se empieza de cero; el checkpoint anterior se sobrescribe con el primer día
+        self.done = set() if restart else self.load_checkpoint()
+
+    def load_checkpoint(self):
+        """Días ya procesados en ejecuciones anteriores"""
+        try:
+            if os.path.exists(self.checkpoint_file):
+                with open(self.checkpoint_file, 'r') as f:
+                    return set(json.load(f).get('done', []))
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el checkpoint del backfill: {e}")
+        return set()
+
+    def save_checkpoint(self):
+        try:
+            tmp_path = f"{self.checkpoint_file}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'done': sorted(self.done)}, f)
+            os.replace(tmp_path, self.checkpoint_file)
+        except Exception as e:
+            logger.error(f"No se pudo guardar el checkpoint del backfill: {e}")
+
+    def fetch_day(self, day):
+        self.bucket.acquire()
+        return self.bot.scrape_day_results(day)
+
+    def days(self, start, end):
+        day = start
+        while day <= end:
+            if day.isoformat() not in self.done:
+                yield day
+            day += timedelta(days=1)
+
+    def crawl(self, start, end):
+        """Genera (día, RaceItems) según van llegando, con como mucho `workers` días en vuelo"""
+        from concurrent.futures import ThreadPoolExecutor, wait
+        pending_days = self.days(start, end)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = {}
+            for day in pending_days:
+                in_flight[executor.submit(self.fetch_day, day)] = day
+                if len(in_flight) >= self.workers:
+                    break
+            while in_flight:
+                finished, _ = wait(in_flight, return_when='FIRST_COMPLETED')
+                for future in finished:
+                    day = in_flight.pop(future)
+                    try:
+                        yield day, future.result()
+                    except Exception as e:
+                        # Sin checkpoint: el día se reintenta en la siguiente ejecución
+                        logger.error(f"Error en el backfill de {day}: {e}")
+                    next_day = next(pending_days, None)
+                    if next_day is not None:
+                        in_flight[executor.submit(self.fetch_day, next_day)] = next_day
+
+    def write_races(self, output, day, races):
+        """Una línea JSON por carrera ya confirmada (enviada o sin envío pedido)"""
+        for race in races:
+            output.write(json.dumps({
+                'date': day.isoformat(),
+                'race': race['race'],
+                'race_class': race['race_class'],
+                'location': race['location'],
+                'podium': [entry._asdict() for entry in race['podium']],
+                'hash': race['hash'],
+                'url': race['url']
+            }, ensure_ascii=False) + "\n")
+        output.flush()
+
+    def run(self, start, end, output):
+        """Filtra y deduplica como el camino en vivo y escribe una línea JSON por carrera
+
+        Un día solo entra en el checkpoint cuando todas sus carreras han llegado
+        a todos sus chats. Si el envío es parcial, lo entregado queda apuntado
+        por chat (como en vivo) y solo se escriben las carreras completas: al
+        reanudar, el resto se envía a los chats que faltan y se escribe entonces.
+        """
+        total = 0
+        seen = set()    # Una carrera de varios días solo se emite la primera vez
+        for day, race_items in self.crawl(start, end):
+            parsed = [self.bot.build_race(race_item) for race_item in race_items]
+            self.bot.save_results(parsed, day)
+            races = []
+            for race in parsed:
+                if race['hash'] in seen or race['hash'] in self.bot.sent_results:
+                    continue
+                if not self.bot.route_race(race):
+                    continue
+                races.append(race)
+
+            if self.send and races:
+                delivered = self.bot.delivery.deliver(races, self.bot.sent_results)
+                complete = self.bot.mark_delivered(races, delivered)
+                self.bot.save_sent_results()
+                if complete < len(races):
+                    sent = [race for race in races if self.bot.delivery.fully_delivered(race, delivered)]
+                    self.write_races(output, day, sent)
+                    seen.update(race['hash'] for race in sent)
+                    total += len(sent)
+                    logger.error(f"Envío incompleto del backfill de {day} ({complete}/{len(races)}), se reintentará")
+                    continue
+
+            self.write_races(output, day, races)
+            seen.update(race['hash'] for race in races)
+            total += len(races)
+            self.done.add(day.isoformat())
+            self.save_checkpoint()
+            logger.info(f"Backfill {day}: {len(races)} carrera(s) nueva(s)")
+
+        if self.bot.http.cache is not None:
+            self.bot.http.cache.flush()
+        logger.info(f"Backfill terminado: {total} carrera(s)")
+
+def parse_args(argv=None):
+    """Argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="ProCycling Alert Bot")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Proceso persistente que sondea en bucle con intervalo adaptativo")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Procesa y envía cada carrera en cuanto está lista (etapas asíncronas con colas acotadas)")
+    parser.add_argument('--offline', action='store_true',
+                        help="Reproduce la ejecución solo con el caché HTTP en disco, sin red ni envíos")
+    parser.add_argument('--profile', action='store_true',
+                        help="Perfila la ejecución con cProfile")
+    parser.add_argument('--profile-file', metavar='FILE', default='procycling.prof',
+                        help="Dónde guardar las estadísticas de --profile (por defecto, %(default)s)")
+    subparsers = parser.add_subparsers(dest='command')
+
+    backfill = subparsers.add_parser('backfill', help="Recupera resultados de días pasados")
+    backfill.add_argument('--from', dest='start', required=True, type=date.fromisoformat, help="Primer día (AAAA-MM-DD)")
+    backfill.add_argument('--to', dest='end', required=True, type=date.fromisoformat, help="Último día (AAAA-MM-DD)")
+    backfill.add_argument('--workers', type=int, default=BACKFILL_WORKERS, help="Días descargados a la vez")
+    backfill.add_argument('--rate', type=float, default=BACKFILL_RATE, help="Peticiones por segundo a PCS")
+    backfill.add_argument('--output', type=argparse.FileType('a', encoding='utf-8'), default=sys.stdout,
+                          help="Archivo JSONL de salida (por defecto, la salida estándar)")
+    backfill.add_argument('--send', action='store_true', help="Envía también las carreras por Telegram")
+    backfill.add_argument('--checkpoint', metavar='PATH',
+                          help="Archivo de checkpoint (por defecto, uno para envío y otro para vista previa)")
+    backfill.add_argument('--restart', action='store_true',
+                          help="Ignora el checkpoint y vuelve a procesar todos los días del rango")
+
+    query = subparsers.add_parser('query', help="Consulta el histórico local de resultados")
+    queries = query.add_subparsers(dest='query', required=True)
+    wins = queries.add_parser('wins', help="Victorias de un ciclista")
+    wins.add_argument('rider', help="Nombre del ciclista, en cualquier orden y con o sin acentos")
+    wins.add_argument('--season', type=int, default=date.today().year,
+                      help="Temporada (por defecto la actual; 0 para todas)")
+    podiums = queries.add_parser('podiums', help="Últimos podios")
+    podiums.add_argument('--category', action='append', default=[],
+                         help="Clase UCI (p. ej. 2.UWT); se puede repetir")
+    podiums.add_argument('--limit', type=int, default=10, help="Número de carreras")
+    return parser.parse_args(argv)
+
+def run_query(args):
+    """Resuelve `query` sobre el histórico local, sin red ni Telegram"""
+    results = ResultsStore(RESULTS_DB)
+    start = time.perf_counter()
+    try:
+        if args.query == 'wins':
+            rows = results.wins(args.rider, args.season)
+            name = rows[0][2] if rows else args.rider
+            season = f" en {args.season}" if args.season else ""
+            print(f"{name}: {len(rows)} victoria(s){season}")
+            for race_date, race, _ in rows:
+                print(f"  {race_date}  {race}")
+        else:
+            rows = results.podiums(args.category, args.limit)
+            for race_date, race, location, podium in rows:
+                print(f"{race_date}  {race}" + (f" · {location}" if location else ""))
+                for pos, rider, race_time in podium:
+                    print(f"  {pos}º - {rider}  {race_time}".rstrip())
+            if not rows:
+                print("Sin carreras en el histórico")
+    finally:
+        results.close()
+    logger.info(f"Consulta resuelta en {(time.perf_counter() - start) * 1000:.1f} ms")
 
 if __name__ == '__main__':
+    configure_logging()
+    args = parse_args()
+    if args.command == 'query':
+        # Consulta local: sin bot, red ni caché de enviados
+        sys.exit(run_query(args))
+    if args.offline:
+        OFFLINE_MODE = True
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
     bot = ProCyclingAlertBot()
-    bot.run()
+    try:
+        if args.command == 'backfill':
+            BackfillCrawler(bot, workers=args.workers, rate=args.rate, send=args.send,
+                            checkpoint_file=args.checkpoint, restart=args.restart).run(
+                args.start, args.end, args.output)
+        elif args.daemon:
+            bot.run_daemon(pipeline=args.pipeline)
+        elif args.pipeline:
+            bot.run_pipeline()
+        else:
+            bot.run()
+    except KeyboardInterrupt:
+        logger.info("Daemon detenido")
+    finally:
+        bot.close()
+        if profiler:
+            import pstats
+            profiler.disable()
+            profiler.dump_stats(args.profile_file)
+            logger.info(f"Perfil guardado en {args.profile_file}")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
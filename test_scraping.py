@@ -2,33 +2,31 @@
 """Script de prueba para verificar el scraping sin enviar a Telegram"""
 
 import requests
-from bs4 import BeautifulSoup
 
-# URL de ProCyclingStats
-PROCYCLING_URL = "https://www.procyclingstats.com"
+from bot_loader import load_bot
 
-# Headers para evitar bloqueos
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-    'Accept-Language': 'en-US,en;q=0.5',
-    'Accept-Encoding': 'gzip, deflate',
-    'Connection': 'keep-alive',
-    'Upgrade-Insecure-Requests': '1'
-}
+# Misma URL, cabeceras, backend de parseo y recorte de sección que el bot
+bot = load_bot()
+PROCYCLING_URL = bot.PROCYCLING_URL
 
 print("🔍 Testeando scraping de ProCyclingStats...\n")
 
 try:
     print(f"📡 Conectando a {PROCYCLING_URL}...")
-    response = requests.get(PROCYCLING_URL, headers=HEADERS, timeout=10)
+    response = requests.get(PROCYCLING_URL, headers=bot.HEADERS, timeout=10)
     print(f"✅ Status code: {response.status_code}")
 
     if response.status_code != 200:
         print(f"❌ Error: Código de respuesta {response.status_code}")
         exit(1)
 
-    soup = BeautifulSoup(response.content, 'html.parser')
+    print(f"🧩 Parser: {bot.HTML_PARSER}")
+
+    # Recortar la sección antes de parsear; si no aparece, parsear la página entera
+    # Sin charset en Content-Type, requests decodificaría como ISO-8859-1; PCS sirve UTF-8
+    response.encoding = bot.response_encoding(response.headers)
+    html = response.text
+    soup = bot.make_soup(bot.extract_results_section(html) or html)
 
     # Buscar el encabezado 'Results today'
     results_header = soup.find('h3', string='Results today')